@@ -1,48 +1,110 @@
 from __future__ import absolute_import
 
-from . import build, dependencies
+import json
+
+from . import build, dependencies, schedule
 from .msg import BuildComplete
+from .source_control import Target
+
+
+def select_targets(source_control, build_targets, dirty_state=None):
+    """
+    Applies build_targets (see dependencies.eval) to the images of the
+    repository before any ref is computed, so only the selected targets
+    pay for their refs.
+    """
+    images = source_control.images()
+    selected = dependencies.eval(build_targets, [
+        Target(image=c, ref=None, children=None) for c in images
+    ])
+    resolved = source_control.targets(
+        images, [t.name for t in selected], dirty_state,
+    )
+    refs = {t.name: t.ref for t in resolved}
+    return [t._replace(ref=refs[t.name]) for t in selected]
 
 
 class Shipwright(object):
-    def __init__(self, source_control, docker_client, tags, cache):
+    def __init__(self, source_control, docker_client, tags, cache, jobs=1,
+                 history=None, explain_schedule=False, fail_fast=False,
+                 dirty_state=None):
         self.source_control = source_control
         self.docker_client = docker_client
         self.tags = tags
+        self.jobs = jobs
+        self.history = history
+        self.explain_schedule = explain_schedule
+        self.fail_fast = fail_fast
+        # the snapshot of uncommitted changes of the run, see
+        # GitSourceControl.dirty_state
+        self.dirty_state = dirty_state
         self._cache = cache
 
-    def targets(self):
-        return self.source_control.targets()
+    def targets(self, build_targets):
+        return select_targets(
+            self.source_control, build_targets, self.dirty_state,
+        )
 
     def build(self, build_targets):
-        targets = dependencies.eval(build_targets, self.targets())
-        this_ref_str = self.source_control.this_ref_str()
+        targets = self.targets(build_targets)
+        this_ref_str = self.source_control.this_ref_str(self.dirty_state)
         return self._build(this_ref_str, targets)
 
     def _build(self, this_ref_str, targets):
         client = self.docker_client
         ref = this_ref_str
         tags = self.source_control.default_tags() + self.tags + [this_ref_str]
-        for evt in build.do_build(client, ref, targets, self._cache):
+        if self.explain_schedule:
+            durations = self.history.durations() if self.history else {}
+            for line in schedule.explain(targets, durations, self.jobs):
+                yield {'stream': line, 'event': 'log'}
+        build_evts = build.do_build(
+            client, ref, targets, self._cache, jobs=self.jobs,
+            history=self.history, fail_fast=self.fail_fast,
+        )
+        for evt in build_evts:
             if isinstance(evt, BuildComplete):
                 target = evt.target
                 for tag_evt in self._cache.tag([target], tags):
                     yield tag_evt
             yield evt
 
-    def images(self, build_targets):
-        for target in dependencies.eval(build_targets, self.targets()):
-            yield {
-                'stream': '{t.name}:{t.ref}'.format(t=target),
-                'event': 'log',
-            }
+    def images(self, build_targets, graph=False):
+        """
+        Lists the selected images, or with graph a single json document of
+        the images grouped in build levels (see dependencies.levels) and of
+        the parent -> child edges between them.
+        """
+        targets = self.targets(build_targets)
+        if not graph:
+            for target in targets:
+                yield {
+                    'stream': '{t.name}:{t.ref}'.format(t=target),
+                    'event': 'log',
+                }
+            return
+
+        doc = {
+            'levels': [
+                ['{t.name}:{t.ref}'.format(t=t) for t in level]
+                for level in dependencies.levels(targets)
+            ],
+            'edges': [
+                [parent.name, child.name]
+                for parent, child in dependencies.edges(targets)
+            ],
+        }
+        yield {
+            'stream': json.dumps(doc, sort_keys=True),
+            'event': 'log',
+        }
 
     def push(self, build_targets, no_build=False):
         """
         Pushes the latest images to the repository.
         """
-        targets = dependencies.eval(build_targets, self.targets())
-        this_ref_str = self.source_control.this_ref_str()
+        targets = self.targets(build_targets)
+        this_ref_str = self.source_control.this_ref_str(self.dirty_state)
         tags = self.source_control.default_tags() + self.tags + [this_ref_str]
 
         if no_build:
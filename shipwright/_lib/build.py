@@ -1,6 +1,10 @@
 from __future__ import absolute_import
 
-from . import docker
+import time
+from multiprocessing.pool import ThreadPool
+
+from . import schedule
+from .compat import queue
 from .msg import BuildComplete
 
 
@@ -10,7 +14,8 @@ def _merge(d1, d2):
     return d
 
 
-def do_build(client, build_ref, targets, cache):
+def do_build(client, build_ref, targets, cache, jobs=1, history=None,
+             fail_fast=False):
     """
     Generic function for building multiple images while
     notifying a callback function with output produced.
@@ -28,24 +33,209 @@ def do_build(client, build_ref, targets, cache):
     The consequences of this is you must either call it as part of a for loop
     or pass it to a function like list() which can consume an iterator.
 
+    With jobs > 1, up to jobs targets are built at a time, see
+    _parallel_build. The seconds every target took to build are recorded
+    in history (a BuildHistory), if given, whose durations also set the
+    priorities of parallel builds.
+
+    A target whose build yields an error fails, and every target built
+    from it, directly or not, is skipped with a skipped event naming it.
+    With fail_fast, the first error ends all of the builds instead.
     """
 
     build_index = {t.image.name: t.ref for t in targets}
+    durations = history.durations() if history is not None else {}
+    built = {}
+
+    if jobs > 1:
+        priority = schedule.priorities(
+            targets, schedule.estimates(targets, durations),
+        )
+        evts = _parallel_build(
+            client, build_index, targets, cache, jobs, priority, built,
+            fail_fast,
+        )
+    else:
+        evts = _serial_build(
+            client, build_index, targets, cache, built, fail_fast,
+        )
+
+    try:
+        for evt in evts:
+            yield evt
+    finally:
+        if history is not None and built:
+            for name, seconds in built.items():
+                if seconds is not None:
+                    history.record(name, seconds)
+            history.save()
 
+
+def _serial_build(client, build_index, targets, cache, built, fail_fast):
+    children = _children(build_index, targets)
+    skipped = set()
     for target in targets:
-        parent_ref = None
-        if target.parent:
-            parent_ref = build_index.get(target.parent)
-        for evt in build(client, parent_ref, target, cache):
+        if target.name in skipped:
+            continue
+        start = time.time()
+        failed = False
+        any_events = False
+        parent_refs = _parent_refs(build_index, target)
+        for evt in build(client, parent_refs, target, cache):
             yield evt
+            any_events = True
+            if 'error' in evt:
+                if fail_fast:
+                    return
+                failed = True
+        if any_events and not failed:
+            built[target.name] = time.time() - start
         yield BuildComplete(target)
+        if failed:
+            for evt in _skip(children, target, skipped):
+                yield evt
+
+
+def _parent_refs(build_index, target):
+    return {p: build_index[p] for p in target.parents if p in build_index}
+
+
+def _children(build_index, targets):
+    """
+    Maps the name of every target to the targets built from it.
+    """
+    children = {t.name: [] for t in targets}
+    for t in targets:
+        for p in set(t.parents):
+            if p in build_index and p != t.name:
+                children[p].append(t)
+    return children
 
 
-def build(client, parent_ref, image, cache):
+def _skip(children, failed, skipped):
+    """
+    Adds every target built from the failed target, directly or not, to
+    skipped, yielding a skipped event for each one not already there.
+    """
+    todo = [failed]
+    while todo:
+        for child in children[todo.pop().name]:
+            if child.name in skipped:
+                continue
+            skipped.add(child.name)
+            todo.append(child)
+            yield {
+                'event': 'skipped',
+                'target': child,
+                'rev': child.ref,
+                'failed': failed.name,
+            }
+
+
+_DONE = object()
+
+
+class _Failed(object):
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _parallel_build(client, build_index, targets, cache, jobs, priority,
+                    built, fail_fast):
+    """
+    Builds targets on jobs worker threads. Whenever a worker is idle, it
+    starts the target whose parents among targets are all complete with the
+    highest priority (see schedule.priorities), and then the first in the
+    order of targets, the way schedule.simulate plays it.
+
+    The seconds each target that had anything to build, and did so without
+    an error, took are set in the dict built. The targets built from one
+    that failed are skipped as soon as it completes.
+
+    Every event is still yielded from the calling thread, so whatever the
+    caller does with a BuildComplete (tagging, pushing) overlaps with the
+    builds still running.
+    """
+    events = queue.Queue()
+    # seconds from the start of the build of each target to its end
+    elapsed = {}
+
+    def work(target):
+        start = time.time()
+        try:
+            parent_refs = _parent_refs(build_index, target)
+            for evt in build(client, parent_refs, target, cache):
+                events.put((target, evt))
+        except Exception as e:
+            events.put((target, _Failed(e)))
+        else:
+            elapsed[target.name] = time.time() - start
+            events.put((target, _DONE))
+
+    children = _children(build_index, targets)
+    waiting_on = {t.name: set() for t in targets}
+    for name, kids in children.items():
+        for child in kids:
+            waiting_on[child.name].add(name)
+    failed = set()
+    skipped = set()
+    position = {t.name: i for i, t in enumerate(targets)}
+    pending = list(targets)
+    running = [0]
+
+    pool = ThreadPool(jobs)
+
+    def start_ready():
+        # only as many as there are idle workers, so that a target that
+        # becomes ready later is not queued behind lower priority ones
+        ready = [t for t in pending if not waiting_on[t.name]]
+        if not ready and pending and not running[0]:
+            # a cycle between parents, build in the given order
+            ready = pending[:1]
+        ready.sort(key=lambda t: (-priority[t.name], position[t.name]))
+        for t in ready[:jobs - running[0]]:
+            pending.remove(t)
+            running[0] += 1
+            pool.apply_async(work, (t,))
+
+    try:
+        start_ready()
+        while running[0]:
+            target, evt = events.get()
+            if isinstance(evt, _Failed):
+                raise evt.exc
+            if evt is not _DONE:
+                built[target.name] = None
+                yield evt
+                if 'error' in evt:
+                    if fail_fast:
+                        return
+                    failed.add(target.name)
+                continue
+            if target.name in failed:
+                del built[target.name]
+            elif target.name in built:
+                built[target.name] = elapsed[target.name]
+            running[0] -= 1
+            skips = []
+            if target.name in failed:
+                skips = list(_skip(children, target, skipped))
+                pending[:] = [t for t in pending if t.name not in skipped]
+            for child in children[target.name]:
+                waiting_on[child.name].discard(target.name)
+            start_ready()
+            yield BuildComplete(target)
+            for evt in skips:
+                yield evt
+    finally:
+        pool.terminate()
+
+
+def build(client, parent_refs, image, cache):
     """
     builds the given image tagged with <build_ref> and ensures that
-    it depends on it's parent if it's part of this build group (shares
-    the same namespace)
+    it depends on it's parents that are part of this build group (shares
+    the same namespace), parent_refs maps their names to their refs.
     """
 
     merge_config = {
@@ -57,9 +247,8 @@ def build(client, parent_ref, image, cache):
     def process_event_(evt):
         return _merge(merge_config, evt)
 
-    built_tags = docker.last_built_from_docker(client, image.name)
-    if image.ref in built_tags:
+    if (image.name, image.ref) in cache.inventory:
         return
 
-    for evt in cache.build(parent_ref, image):
+    for evt in cache.build(parent_refs, image):
         yield process_event_(evt)
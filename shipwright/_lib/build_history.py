@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+import json
+
+from . import json_store
+
+
+class BuildHistory(object):
+    """
+    Remembers how many seconds the last build of every image took, in a
+    json file. Any problem reading or writing the file is treated as an
+    empty history.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._durations = None
+
+    def durations(self):
+        """
+        Returns a dict of image name -> seconds.
+        """
+        if self._durations is None:
+            try:
+                with open(self.path) as f:
+                    self._durations = json.load(f).get('durations', {})
+            except (IOError, OSError, ValueError):
+                self._durations = {}
+        return self._durations
+
+    def record(self, name, seconds):
+        self.durations()[name] = seconds
+
+    def save(self):
+        json_store.dump(self.path, {'durations': self.durations()})
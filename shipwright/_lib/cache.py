@@ -30,8 +30,12 @@ _FAILED = object()
 
 
 class NoCache(object):
-    def __init__(self, docker_client):
+    def __init__(self, docker_client, contexts=None, minimal_context=None):
         self.docker_client = docker_client
+        self.contexts = contexts
+        # image -> bool, whether to build image from a minimal context
+        self.minimal_context = minimal_context
+        self.inventory = docker.ImageInventory(docker_client)
         self._pulled_images = {}
 
     def _pull_cache(self, image):
@@ -45,6 +49,7 @@ class NoCache(object):
                     self.docker_client,
                     image,
                     tag,
+                    self.inventory,
                 )
 
     def push(self, targets, tags):
@@ -65,7 +70,7 @@ class NoCache(object):
         for evt in push.do_push(self.docker_client, sorted(names_and_tags)):
             yield evt
 
-    def build(self, parent_ref, image):
+    def build(self, parent_refs, image):
         repo = image.name
         tag = image.ref
         client = self.docker_client
@@ -78,28 +83,51 @@ class NoCache(object):
         else:
             return
 
-        # pull the parent if it has not been built because Docker-py fails
-        # to send the correct credentials in the build command.
-        if parent_ref:
+        # pull the parents if they have not been built because Docker-py
+        # fails to send the correct credentials in the build command.
+        for parent in image.parents:
+            if parent not in parent_refs:
+                continue
             try:
-                for evt in self._pull(image.parent, parent_ref):
+                for evt in self._pull(parent, parent_refs[parent]):
                     yield evt
             except PullFailedException:
                 pass
 
-        build_evts = client.build(
-            fileobj=tar.mkcontext(parent_ref, image.path),
-            rm=True,
-            custom_context=True,
-            stream=True,
-            tag='{0}:{1}'.format(image.name, image.ref),
-            dockerfile=os.path.basename(image.path),
-        )
-
-        for evt in build_evts:
-            yield compat.json_loads(evt)
+        sources = None
+        if self.minimal_context is not None and self.minimal_context(image):
+            sources = image.copy_paths
+        files = tar.context_files(parent_refs, image.path, sources)
+        if sources is not None:
+            yield {
+                'stream': 'Minimal context leaves out {:,} bytes\n'.format(
+                    files.left_out,
+                ),
+                'context_bytes_saved': files.left_out,
+            }
+
+        context = tar.tar_context(files, self.contexts)
+        try:
+            build_evts = client.build(
+                fileobj=context,
+                rm=True,
+                custom_context=True,
+                stream=True,
+                tag='{0}:{1}'.format(image.name, image.ref),
+                dockerfile=os.path.basename(image.path),
+            )
+
+            failed = False
+            for evt in build_evts:
+                evt = compat.json_loads(evt)
+                failed = failed or 'error' in evt
+                yield evt
+        finally:
+            context.close()
 
         self._pulled_images[(repo, tag)] = True
+        if not failed:
+            self.inventory.add(repo, tag)
 
     def _pull(self, repo, tag):
         already_pulled = self._pulled_images.get((repo, tag), False)
@@ -130,6 +158,7 @@ class NoCache(object):
             raise PullFailedException()
 
         self._pulled_images[(repo, tag)] = True
+        self.inventory.add(repo, tag)
 
 
 class Cache(NoCache):
@@ -143,8 +172,11 @@ class Cache(NoCache):
 
 
 class DirectRegistry(NoCache):
-    def __init__(self, docker_client, docker_registry):
-        super(DirectRegistry, self).__init__(docker_client)
+    def __init__(self, docker_client, docker_registry, contexts=None,
+                 minimal_context=None):
+        super(DirectRegistry, self).__init__(
+            docker_client, contexts, minimal_context,
+        )
         self.drc = docker_registry
         self._cache = {}
 
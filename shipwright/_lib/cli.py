@@ -66,7 +66,7 @@ from itertools import chain, cycle
 import docker
 from docker.utils import kwargs_from_env
 
-from . import cache, registry, source_control
+from . import build_history, cache, context_cache, registry, source_control
 from .base import Shipwright
 from .colors import rainbow
 from .msg import Message
@@ -76,6 +76,8 @@ try:
 except ImportError as e:
     drc = e
 
+MEGABYTE = 1024 * 1024
+
 
 def argparser():
     def a_arg(parser, *args, **kwargs):
@@ -118,6 +120,15 @@ def argparser():
         help='Build working tree, including uncommited and untracked changes',
         action='store_true',
     )
+    common.add_argument(
+        '-j', '--jobs',
+        help=(
+            'Number of images to build, and of git processes to run when '
+            'computing refs, in parallel'
+        ),
+        type=int,
+        default=1,
+    )
     common.add_argument(
         '--pull-cache',
         help='When building try to pull previously built images',
@@ -152,16 +163,56 @@ def argparser():
         help='extra tags to apply to the images',
     )
 
-    subparsers.add_parser(
-        'build', help='builds images', parents=[common],
+    building = argparse.ArgumentParser(add_help=False)
+    building.add_argument(
+        '--explain-schedule',
+        help=(
+            'Before building, print the predicted build time and the order '
+            'images will be built in, from the durations of earlier builds'
+        ),
+        action='store_true',
+    )
+    building.add_argument(
+        '--context-cache-size',
+        help=(
+            'Megabytes of build contexts to keep in .git/shipwright/contexts '
+            'for images built again from the same files, e.g. {}. Kept '
+            'contexts give every file a modification time of 0 and root as '
+            'owner (default: 0, keep none)'.format(
+                context_cache.DEFAULT_MAX_BYTES // MEGABYTE,
+            )
+        ),
+        type=int,
+        default=0,
+    )
+    building.add_argument(
+        '--fail-fast',
+        help=(
+            'Stop building at the first error, instead of only skipping the '
+            'images built from the one that failed'
+        ),
+        action='store_true',
     )
 
     subparsers.add_parser(
+        'build', help='builds images', parents=[common, building],
+    )
+
+    images = subparsers.add_parser(
         'images', help='lists images to build', parents=[common],
     )
+    images.add_argument(
+        '--graph',
+        help=(
+            'Print the images as json, grouped in levels that can be built '
+            'in parallel, along with the edges between them'
+        ),
+        action='store_true',
+    )
 
     push = subparsers.add_parser(
-        'push', help='pushes built images', parents=[common],
+        'push', help='pushes built images',
+        parents=[common, building],
     )
     push.add_argument('--no-build', action='store_true')
 
@@ -201,6 +252,7 @@ def old_style_arg_dict(namespace):
         '--dump-file': ns.dump_file,
         '--exact': _flatten(ns.exact),
         '--exclude': _flatten(ns.exclude),
+        '--graph': getattr(ns, 'graph', False),
         '--help': False,
         '--no-build': getattr(ns, 'no_build', False),
         '--upto': _flatten(ns.upto),
@@ -282,30 +334,72 @@ class SetJSONEncoder(json.JSONEncoder):
         return super(SetJSONEncoder, self).decode(obj)
 
 
+def _minimal_context(names):
+    """
+    Returns whether to build an image from a minimal context, given the
+    minimal_context config: true for every image, or a list of the names or
+    short names of the images.
+
+    >>> from collections import namedtuple
+    >>> Image = namedtuple('Image', ['name', 'short_name'])
+    >>> _minimal_context(['base'])(Image('shipwright/base', 'base'))
+    True
+    >>> _minimal_context(False)(Image('shipwright/base', 'base'))
+    False
+    """
+    if names is True:
+        return lambda image: True
+    names = frozenset(names or ())
+    return lambda image: image.name in names or image.short_name in names
+
+
 def run(path, arguments, client_cfg, environ, new_style_args=None):
     args = process_arguments(
         path, arguments, client_cfg, environ,
     )
     build_targets, no_build, command_name, dump_file, config, client = args
+    graph = command_name == 'images' and arguments.get('--graph', False)
 
     if new_style_args is None:
         dirty = False
         pull_cache = False
         registry_logins = []
+        jobs = 1
+        explain = False
+        fail_fast = False
+        context_cache_size = 0
     else:
         dirty = new_style_args.dirty
         pull_cache = new_style_args.pull_cache
         registry_logins = _flatten(new_style_args.registry_login)
+        jobs = new_style_args.jobs
+        explain = getattr(new_style_args, 'explain_schedule', False)
+        fail_fast = getattr(new_style_args, 'fail_fast', False)
+        context_cache_size = getattr(new_style_args, 'context_cache_size', 0)
 
     namespace = config['namespace']
     name_map = config.get('names', {})
-    scm = source_control.source_control(path, namespace, name_map)
-    if not dirty and scm.is_dirty():
+    scm = source_control.source_control(
+        path, namespace, name_map, ref_mode=config.get('ref_mode'), jobs=jobs,
+    )
+    # one snapshot of the uncommitted changes for the whole run
+    dirty_state = scm.dirty_state()
+    if not dirty and scm.is_dirty(dirty_state):
         return (
             'Aborting build, due to uncommitted changes. If you are not ready '
             'to commit these changes, re-run with the --dirty flag.'
         )
 
+    minimal_context = _minimal_context(config.get('minimal_context', False))
+
+    contexts = None
+    if context_cache_size > 0:
+        contexts = context_cache.ContextCache(
+            os.path.join(scm.cache_dir, 'contexts'),
+            max_bytes=context_cache_size * MEGABYTE,
+            blob_ids=scm.blob_ids,
+        )
+
     if registry_logins:
         if isinstance(drc, Exception):
             raise drc
@@ -319,13 +413,22 @@ def run(path, arguments, client_cfg, environ, new_style_args=None):
                 password=config['password'],
                 api_version=2,
             )
-        the_cache = cache.DirectRegistry(client, registry.Registry(registries))
+        the_cache = cache.DirectRegistry(
+            client, registry.Registry(registries), contexts, minimal_context,
+        )
     elif pull_cache:
-        the_cache = cache.Cache(client)
+        the_cache = cache.Cache(client, contexts, minimal_context)
     else:
-        the_cache = cache.NoCache(client)
+        the_cache = cache.NoCache(client, contexts, minimal_context)
 
-    sw = Shipwright(scm, client, arguments['tags'], the_cache)
+    history = build_history.BuildHistory(
+        os.path.join(scm.cache_dir, 'build-durations.json'),
+    )
+    sw = Shipwright(
+        scm, client, arguments['tags'], the_cache, jobs=jobs,
+        history=history, explain_schedule=explain, fail_fast=fail_fast,
+        dirty_state=dirty_state,
+    )
     command = getattr(sw, command_name)
 
     show_progress = sys.stdout.isatty()
@@ -334,6 +437,8 @@ def run(path, arguments, client_cfg, environ, new_style_args=None):
 
     if no_build:
         events = command(build_targets, no_build)
+    elif graph:
+        events = command(build_targets, graph=graph)
     else:
         events = command(build_targets)
 
@@ -349,6 +454,11 @@ def run(path, arguments, client_cfg, environ, new_style_args=None):
         if msg is not None:
             print(msg)
 
+    if dump_file and scm.discovery_time is not None:
+        discovery = {'event': 'discovery', 'seconds': scm.discovery_time}
+        json.dump(discovery, dump_file)
+        dump_file.write('\n')
+
     if errors:
         print('The following errors occurred:', file=sys.stdout)
         messages = [pretty_event(error, True) for error in errors]
@@ -374,7 +484,8 @@ def pretty_event(evt, show_progress):
     formatted_message = switch(evt, show_progress)
     if formatted_message is None:
         return
-    if not (evt['event'] in ('build_msg', 'push') or 'error' in evt):
+    if not (evt['event'] in ('build_msg', 'push', 'skipped') or
+            'error' in evt):
         return formatted_message
 
     name = None
@@ -426,6 +537,8 @@ def switch(rec, show_progress):
         return '[ERROR] {0}'.format(rec['errorDetail']['message'])
     elif 'warn' in rec:
         return '[WARN] {0}'.format(rec['errorDetail']['message'])
+    elif rec['event'] == 'skipped':
+        return '[SKIPPED] {0} failed to build'.format(rec['failed'])
     elif rec['event'] == 'tag':
         fmt = 'Tagging {rec[old_image]} to {rec[repository]}:{rec[tag]}'
         return fmt.format(rec=rec)
@@ -1,11 +1,18 @@
 from __future__ import absolute_import
 
 import json
+import os
 import sys
 
 PY2 = sys.version_info[0] == 2
 
 
+if PY2:
+    import Queue as queue  # noqa: F401
+else:
+    import queue  # noqa: F401
+
+
 if PY2:
     json_loads = json.loads
 else:
@@ -13,3 +20,12 @@ else:
         if isinstance(s, bytes):
             s = s.decode('utf8')
         return json.loads(s, **kwargs)
+
+
+if PY2:
+    def fsdecode(path):
+        return path
+else:
+    # paths from git decoded like the os module decodes file names, so
+    # that ones that are not valid in the file system encoding still match
+    fsdecode = os.fsdecode
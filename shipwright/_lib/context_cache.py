@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+
+import os
+import threading
+
+# the most bytes of build contexts kept, by default
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ContextCache(object):
+    """
+    Keeps the build contexts of earlier builds in the directory path, as
+    tar files named after the digest of their content (see tar.mkcontext).
+    Once they take more than max_bytes, the least recently used ones are
+    removed.
+
+    blob_ids, if given, is called the first time a context is digested for
+    a dict of full path -> blob id of the files git already hashed, which
+    then do not need to be read. Contexts with any other file are not kept
+    (see tar.tar_context).
+
+    Any problem reading or writing the directory is treated as a miss.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, blob_ids=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._get_blob_ids = blob_ids
+        self._blob_ids = None
+        self._lock = threading.Lock()
+
+    def blob_ids(self):
+        with self._lock:
+            if self._blob_ids is None:
+                self._blob_ids = {}
+                if self._get_blob_ids is not None:
+                    self._blob_ids = self._get_blob_ids()
+        return self._blob_ids
+
+    def _path(self, digest):
+        return os.path.join(self.path, digest + '.tar')
+
+    def get(self, digest):
+        """
+        Returns the context with digest as an open file, or None.
+        """
+        path = self._path(digest)
+        try:
+            f = open(path, 'rb')
+            # modification times order the contexts by their last use
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return f
+
+    def put(self, digest, size, chunks):
+        """
+        Yields chunks, and keeps them as the context with digest once they
+        have all been read. size, the size of the files in the context,
+        tells ahead of time that a context is too large to keep.
+        """
+        path = self._path(digest)
+        f = None
+        if size <= self.max_bytes:
+            tmp_path = '{}.{}.{}.tmp'.format(
+                path, os.getpid(), threading.current_thread().ident,
+            )
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                f = open(tmp_path, 'wb')
+            except (IOError, OSError):
+                f = None
+
+        try:
+            for chunk in chunks:
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                    except IOError:
+                        f.close()
+                        f = None
+                        _remove(tmp_path)
+                yield chunk
+            if f is not None:
+                f.close()
+                f = None
+                try:
+                    os.rename(tmp_path, path)
+                except OSError:
+                    _remove(tmp_path)
+                else:
+                    self._evict()
+        finally:
+            if f is not None:
+                # the context was not read to the end
+                f.close()
+                _remove(tmp_path)
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            try:
+                for name in os.listdir(self.path):
+                    if name.endswith('.tar'):
+                        path = os.path.join(self.path, name)
+                        st = os.stat(path)
+                        entries.append((st.st_mtime, path, st.st_size))
+            except OSError:
+                return
+            total = sum(size for _, _, size in entries)
+            for _, path, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                _remove(path)
+                total -= size
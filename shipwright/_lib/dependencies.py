@@ -1,9 +1,6 @@
 from __future__ import absolute_import
 
 import operator
-from collections import namedtuple
-
-from . import zipper
 
 
 # [(tree -> [ImageNames])] -> [Images]
@@ -18,172 +15,236 @@ def eval(build_targets, targets):
     Then returns the results of applying each exclusion functinon
     in order.
 
+    The tree hangs every image under its primary parent, the other parents
+    of images built from several in-repo images (multi-stage Dockerfiles)
+    are followed by each function, and the result lists every image after
+    all of its parents.
     """
-    tree = _make_tree(targets)
+    graph = _make_graph(targets)
     bt = build_targets
 
     exact, dependents, upto = bt['exact'], bt['dependents'], bt['upto']
     if exact or dependents or upto:
-        base = set()
+        base = {}
         for target in exact:
-            base = base | set(_exact(target, tree))
+            base.update((t.name, t) for t in _exact(target, graph))
         for target in dependents:
-            base = base | set(_dependents(target, tree))
+            base.update((t.name, t) for t in _dependents(target, graph))
         for target in upto:
-            base = base | set(_upto(target, tree))
+            base.update((t.name, t) for t in _upto(target, graph))
 
-        tree = _make_tree(base)
+        graph = _make_graph(base.values())
 
     for target in bt['exclude']:
-        tree = _exclude(target, tree)
-
-    return _brood(tree)
+        graph = _exclude(target, graph)
 
+    return _parents_first(_brood(graph))
 
-_Root = namedtuple('_Root', ['name', 'short_name', 'children'])
 
+_by_name = operator.attrgetter('name')
 
-def _find(tree, name):
-    def find_(loc):
-        target = loc.node()
-        return target.name == name or target.short_name == name
 
-    return tree.find(find_)
+class _Graph(object):
+    """
+    The images as a DAG, indexed by name and short name.
 
+    Every image hangs under its primary parent (the parent attribute) when
+    that is in the graph, or else is a root. Roots and the children of every
+    image are kept sorted by name. dependents lists, for each image, the
+    images built from it through any of their parents.
+    """
 
-def _make_tree(images):
+    def __init__(self, images):
+        self.nodes = {}
+        self._short_names = {}
+        for image in images:
+            self.nodes.setdefault(image.name, image)
+            self._short_names.setdefault(image.short_name, image)
+
+        self.roots = []
+        self.children = {name: [] for name in self.nodes}
+        self.dependents = {name: [] for name in self.nodes}
+        for image in sorted(self.nodes.values(), key=_by_name):
+            if self.primary_parent(image) is None:
+                self.roots.append(image)
+            else:
+                self.children[image.parent].append(image)
+            for p in self.parents(image):
+                self.dependents[p].append(image)
+
+    def find(self, name):
+        """Looks an image up by name, or else by short name."""
+        image = self.nodes.get(name)
+        if image is None:
+            image = self._short_names.get(name)
+        return image
+
+    def primary_parent(self, image):
+        parent = image.parent
+        if parent != image.name and parent in self.nodes:
+            return parent
+
+    def parents(self, image):
+        """The names of the parents of image in the graph."""
+        names = []
+        for p in (image.parent,) + tuple(image.parents):
+            if p != image.name and p in self.nodes and p not in names:
+                names.append(p)
+        return names
+
+
+# [Target] -> Graph
+def _make_graph(images):
+    return _Graph(images)
+
+
+# Graph -> [Target]
+def _brood(graph):
     """
-    Converts a list of images into a tree represented by a zipper.
-    see http://en.wikipedia.org/wiki/Zipper_(data_structure)
+    Returns every image of graph breadth first, starting from the roots.
     """
-
-    root = _Root(None, None, ())
-    tree = zipper.zipper(root, _is_branch, _children, _make_node)
-
-    for c in images:
-
-        def is_child(target):
-            if not isinstance(target, _Root):
-                return target.parent == c.name
-
-        branch_children, root_children = _split(is_child, tree.children())
-        t = c._replace(children=tuple(branch_children))
-
-        if branch_children:
-            tree = tree.edit(_replace, tuple(root_children))
-
-        loc = _find(tree, t.parent)
-        if loc:
-            tree = loc.insert(t).top()
-        else:
-            tree = tree.insert(t)
-
-    return tree
-
-
-def _replace(node, children):
-    return node._replace(children=children)
-
-
-def _children(item):
-    return item.children
-
-
-def _is_branch(item):
-    return True
-
-
-def _make_node(node, children):
-    # keep children sorted to make testing easier
-    ch = tuple(sorted(children, key=operator.attrgetter('name')))
-    return node._replace(children=ch)
-
-
-def _breadth_first_iter(loc):
+    results = list(graph.roots)
+    seen = {t.name for t in results}
+    i = 0
+    while True:
+        while i < len(results):
+            for child in graph.children[results[i].name]:
+                if child.name not in seen:
+                    seen.add(child.name)
+                    results.append(child)
+            i += 1
+        if len(results) == len(graph.nodes):
+            return results
+        # a cycle of primary parents, which hangs from no root
+        cycle = min(
+            (t for name, t in graph.nodes.items() if name not in seen),
+            key=_by_name,
+        )
+        seen.add(cycle.name)
+        results.append(cycle)
+
+
+# [Target] -> [Target]
+def _parents_first(targets):
     """
-    Given a loctation node (from a zipper) walk it's children in breadth first
-    order.
+    Reorders targets so that every target follows all of its parents within
+    targets, keeping the order of targets otherwise.
     """
-
-    tocheck = [loc]
-    while tocheck:
-        l = tocheck.pop(0)
-        yield l
-        child = l.down()
-        while child:
-            tocheck.append(child)
-            child = child.right()
-
-
-# Loc -> [Target]
-def _lineage(loc):
+    names = {t.name for t in targets}
+    done = set()
     results = []
-    while loc.path:
-        node = loc.node()
-        results.append(node)
-        loc = loc.up()
+    pending = targets
+    while pending:
+        waiting = []
+        for t in pending:
+            if all(p in done or p not in names for p in t.parents):
+                done.add(t.name)
+                results.append(t)
+            else:
+                waiting.append(t)
+        if len(waiting) == len(pending):
+            # a cycle, there is no order to keep
+            results.extend(waiting)
+            break
+        pending = waiting
     return results
 
 
-# (a -> Bool) -> [a] ->[a], [a]
-def _split(f, children):
+# [Target] -> [(Target, Target)]
+def edges(targets):
+    """
+    Returns a (parent, child) pair for every parent of every target that is
+    itself one of targets.
+    """
+    graph = _make_graph(targets)
+    return [
+        (graph.nodes[p], t) for t in targets for p in graph.parents(t)
+    ]
+
+
+# [Target] -> [[Target]]
+def levels(targets):
     """
-    Given a function that returns true or false and a list. Return
-    a two lists all items f(child) == True is in list 1 and
-    all items not in the list are in list 2.
+    Groups targets by dependency depth, so that every target of a level can
+    be built once the levels before it are. The first level holds the
+    targets without a parent among targets, any other target is one level
+    below its deepest parent. Targets keep their order within a level.
     """
+    graph = _make_graph(targets)
+    depths = {}
+    for t in _parents_first(targets):
+        depths[t.name] = 1 + max(
+            [depths.get(p, -1) for p in graph.parents(t)] or [-1],
+        )
+
+    results = []
+    for t in targets:
+        while len(results) <= depths[t.name]:
+            results.append([])
+        results[depths[t.name]].append(t)
+    return [level for level in results if level]
 
-    l1 = []
-    l2 = []
-    for child in children:
-        if f(child):
-            l1.append(child)
-        else:
-            l2.append(child)
-    return l1, l2
 
+# Target -> Graph -> [Target]
+def _descendants(target, graph):
+    """Returns everything that depends on target"""
 
-# Loc -> [Target]
-def _brood(loc):
-    return [loc.node() for loc in _breadth_first_iter(loc)][1:]
+    results = []
+    seen = {target.name}
+    todo = [target]
+    while todo:
+        for t in graph.dependents[todo.pop().name]:
+            if t.name not in seen:
+                seen.add(t.name)
+                results.append(t)
+                todo.append(t)
+    return results
 
 
-# Target -> Tree -> [Target]
-def _upto(target, tree):
+# Target -> Graph -> [Target]
+def _upto(target, graph):
     """Returns target and everything it depends on"""
 
-    loc = _find(tree, target)
+    target = graph.find(target)
 
-    return _lineage(loc)  # _make_tree(lineage(loc))
+    results = [target]
+    seen = {target.name}
+    for t in results:
+        # results grows while iterating, with the parents of each result
+        for p in graph.parents(t):
+            if p not in seen:
+                seen.add(p)
+                results.append(graph.nodes[p])
+    return results
 
 
-# Target -> Tree -> [Target]
-def _dependents(target, tree):
+# Target -> Graph -> [Target]
+def _dependents(target, graph):
     """Returns a target it's dependencies and everything that depends on it"""
 
-    loc = _find(tree, target)
-
-    return _lineage(loc) + _brood(loc)
+    results = _upto(target, graph)
+    return results + _descendants(results[0], graph)
 
 
-# Target -> Tree -> [Target]
-def _exact(target, tree):
+# Target -> Graph -> [Target]
+def _exact(target, graph):
     """Returns only the target."""
 
-    loc = _find(tree, target)
+    return [graph.find(target)]
 
-    return [loc.node()]
 
-
-# Target -> Tree -> Tree
-def _exclude(target, tree):
+# Target -> Graph -> Graph
+def _exclude(target, graph):
     """
     Returns everything but the target and it's dependents. If target
-    is not found the whole tree is returned.
+    is not found the whole graph is returned.
     """
 
-    loc = _find(tree, target)
-    if loc:
-        return loc.remove().top()
-    else:
-        return tree
+    target = graph.find(target)
+    if target is None:
+        return graph
+
+    removed = {target.name} | {t.name for t in _descendants(target, graph)}
+    return _make_graph(
+        t for name, t in graph.nodes.items() if name not in removed
+    )
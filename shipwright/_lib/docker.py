@@ -1,44 +1,55 @@
 from __future__ import absolute_import
 
+import threading
+
 from docker import errors as d_errors
 
 
-def key_from_image_name(image_name):
+class ImageInventory(object):
     """
-    >>> key_from_image_name('shipwright/blah:1234')
-    '1234'
+    The tagged images of the docker daemon, listed with a single call the
+    first time they are needed and then kept up to date as images are
+    built, pulled and tagged.
+
+    Maps (repository, tag) to the id of the image, or to None when the image
+    is known to exist but not its id.
     """
-    return image_name.split(':', 1)[1]
 
+    def __init__(self, client):
+        self.client = client
+        self._ids = None
+        self._lock = threading.Lock()
 
-def key_from_image_info(image_info_dict):
-    """
-    >>> key_from_image_info({
-    ...     'RepoTags': [
-    ...         'shipwright/base:6e29823388f8', 'shipwright/base:test',
-    ...     ]
-    ... })
-    ['6e29823388f8', 'test']
-    """
-    return [key_from_image_name(t) for t in image_info_dict['RepoTags']]
+    def _images(self):
+        with self._lock:
+            if self._ids is None:
+                ids = {}
+                for image in self.client.images():
+                    for repo_tag in image['RepoTags'] or ():
+                        repository, _, tag = repo_tag.rpartition(':')
+                        ids[(repository, tag)] = image['Id']
+                self._ids = ids
+        return self._ids
 
+    def __contains__(self, repository_and_tag):
+        return repository_and_tag in self._images()
 
-def last_built_from_docker(client, name):
-    images = client.images(name)
-    built_tags = set()
-    for image in images:
-        if image['RepoTags'] is None:
-            continue
-        for key in key_from_image_info(image):
-            built_tags.add(key)
-    return built_tags
+    def get(self, repository, tag):
+        return self._images().get((repository, tag))
+
+    def add(self, repository, tag, image_id=None):
+        self._images()[(repository, tag)] = image_id
 
 
 def encode_tag(tag):
     return tag.replace('/', '-')
 
 
-def tag_image(client, image, new_ref):
+def tag_image(client, image, new_ref, inventory=None):
+    """
+    Tags image with new_ref. With an inventory, the call to docker is
+    skipped when the tag already points at the image.
+    """
     tag = encode_tag(new_ref)
     old_image = image.name + ':' + image.ref
     repository = image.name
@@ -48,6 +59,11 @@ def tag_image(client, image, new_ref):
         'repository': repository,
         'tag': tag,
     }
+    image_id = None
+    if inventory is not None:
+        image_id = inventory.get(repository, image.ref)
+        if image_id is not None and inventory.get(repository, tag) == image_id:
+            return evt
     try:
         client.tag(
             old_image,
@@ -58,6 +74,9 @@ def tag_image(client, image, new_ref):
     except d_errors.NotFound:
         message = 'Error tagging {}, not found'.format(old_image)
         evt.update(error(message))
+    else:
+        if inventory is not None:
+            inventory.add(repository, tag, image_id)
 
     return evt
 
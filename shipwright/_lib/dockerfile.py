@@ -0,0 +1,208 @@
+from __future__ import absolute_import
+
+import json
+import os
+import re
+from collections import namedtuple
+
+from .json_store import mtime_ns
+
+JSONDecodeError = getattr(json, 'JSONDecodeError', ValueError)
+
+# parent: the image of the first FROM line, or None
+# parents: every image the Dockerfile builds from, in order, through FROM
+#          or COPY --from, leaving out references to its own build stages
+# copy_sources: the source paths of every COPY and ADD from the build
+#               context, relative to the Dockerfile's directory
+# from_spans: (image, offset) of the FROM lines and COPY --from flags naming
+#             an untagged image, offset is where the image name ends and
+#             tag_parent inserts the tag
+Dockerfile = namedtuple(
+    'Dockerfile',
+    ['content', 'parent', 'parents', 'copy_sources', 'from_spans'],
+)
+
+_FROM = re.compile(r'\s*from\s+(?:--\S+\s+)*(\S+)(?:\s+as\s+(\S+))?', re.I)
+_COPY = re.compile(r'\s*(?:(copy)|(add))\s', re.I)
+_COPY_FLAG = re.compile(r'\s*--([\w-]+)(?:=(\S*))?\s+')
+_URL = re.compile(r'(https?|ftp):', re.I)
+_IMAGE = (
+    r'(?P<image>'
+    r'(?P<registry>[\w.-]+(?P<port>:\d+)?(?P<path>([\w.-]+/)+|/))?'
+    r'(?P<name>[\w.-]+)'
+    r')'
+)
+_TAGGABLE_FROM = re.compile(
+    r'\s*from\s+(?:--\S+\s+)*' + _IMAGE + r'(?:\s+as\s+\S+)?\s*$',
+    flags=re.IGNORECASE,
+)
+_TAGGABLE_IMAGE = re.compile(_IMAGE + r'$')
+
+_cache = {}
+
+
+def _parse_copy(line):
+    """
+    Returns (from_, from_end, paths) for a COPY or ADD command, where
+    from_ is the value of its --from flag and from_end the offset in line
+    where that value ends, or None when line is not a COPY or ADD.
+    """
+    m = _COPY.match(line)
+    if m is None:
+        return None
+    offset = m.end()
+    copy_cmd = line[offset:]
+
+    from_ = from_end = None
+    flag = _COPY_FLAG.match(copy_cmd)
+    while flag is not None:
+        if flag.group(1).lower() == 'from':
+            from_ = flag.group(2)
+            from_end = offset + flag.end(2)
+        offset += flag.end()
+        copy_cmd = copy_cmd[flag.end():]
+        flag = _COPY_FLAG.match(copy_cmd)
+
+    result = None
+    if copy_cmd.lstrip().startswith('['):
+        try:
+            result = json.loads(copy_cmd)
+        except JSONDecodeError:
+            pass
+
+    if not isinstance(result, list):
+        result = copy_cmd.split(' ')
+
+    paths = result[:-1]
+    if not m.group(1):
+        paths = [p for p in paths if not _URL.match(p)]
+    return from_, from_end, paths
+
+
+def parse_copy(line):
+    """
+    Parse the source directories from a docker COPY or ADD command
+
+    Ignores http or ftp URLs in ADD commands, and copies from other images
+    or build stages.
+
+    >>> parse_copy('COPY a b /code/\\n')
+    ['a', 'b']
+    >>> parse_copy('add ["http://example.com/a", "b", "/code/"]')
+    ['b']
+    >>> parse_copy('COPY --chown=app:app a /code/')
+    ['a']
+    >>> parse_copy('COPY --from=build /out /code/')
+    []
+    >>> parse_copy('RUN cp a b')
+    []
+    """
+    parsed = _parse_copy(line)
+    if parsed is None or parsed[0] is not None:
+        return []
+    return parsed[2]
+
+
+def parse(content):
+    """
+    Parses a Dockerfile in a single pass over its lines.
+
+    References to earlier build stages, by alias in FROM or by alias or
+    index in COPY --from, are resolved within the Dockerfile and are not
+    parents.
+
+    >>> df = parse(
+    ...     'FROM golang AS build\\n'
+    ...     'COPY src /src/\\n'
+    ...     'FROM base\\n'
+    ...     'COPY --from=build /out /app/\\n'
+    ...     'COPY --from=tools /bin/tool /bin/\\n'
+    ...     'FROM build AS test\\n'
+    ... )
+    >>> df.parent
+    'golang'
+    >>> df.parents
+    ('golang', 'base', 'tools')
+    >>> df.copy_sources
+    ('src',)
+    >>> df.from_spans
+    (('golang', 11), ('base', 45), ('tools', 92))
+    """
+    parent = None
+    parents = []
+    aliases = set()
+    copy_sources = []
+    from_spans = []
+
+    def add_parent(name):
+        if name.lower() not in aliases and name not in parents:
+            parents.append(name)
+
+    offset = 0
+    for line in content.split('\n'):
+        m = _FROM.match(line)
+        if m is not None:
+            name, alias = m.groups()
+            if parent is None:
+                parent = name
+            if name.lower() not in aliases:
+                add_parent(name)
+                tag_m = _TAGGABLE_FROM.match(line)
+                if tag_m is not None:
+                    from_spans.append((name, offset + tag_m.end('image')))
+            if alias is not None:
+                aliases.add(alias.lower())
+        else:
+            parsed = _parse_copy(line)
+            if parsed is not None:
+                from_, from_end, paths = parsed
+                if from_ is None:
+                    copy_sources.extend(paths)
+                elif not from_.isdigit() and from_.lower() not in aliases:
+                    add_parent(from_)
+                    if _TAGGABLE_IMAGE.match(from_):
+                        from_spans.append((from_, offset + from_end))
+        offset += len(line) + 1
+
+    return Dockerfile(
+        content=content,
+        parent=parent,
+        parents=tuple(parents),
+        copy_sources=tuple(copy_sources),
+        from_spans=tuple(from_spans),
+    )
+
+
+def load(path):
+    """
+    Parses the Dockerfile at path, reusing the previous parse for as long
+    as the file's mtime and size are unchanged.
+    """
+    st = os.stat(path)
+    key = (mtime_ns(st), st.st_size)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with open(path) as f:
+        dockerfile = parse(f.read())
+    _cache[path] = (key, dockerfile)
+    return dockerfile
+
+
+def tag_parent(dockerfile, tags):
+    """
+    Returns the content of dockerfile with the tag in the dict tags added to
+    every FROM line naming an untagged image in tags.
+    """
+    content = dockerfile.content
+    parts = []
+    start = 0
+    for image, end in dockerfile.from_spans:
+        if image not in tags:
+            continue
+        parts.append(content[start:end])
+        parts.append(':' + tags[image])
+        start = end
+    parts.append(content[start:])
+    return ''.join(parts)
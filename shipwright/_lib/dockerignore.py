@@ -0,0 +1,174 @@
+from __future__ import absolute_import
+
+import os
+import re
+from collections import defaultdict
+
+
+def _translate(pattern):
+    """
+    Translates a .dockerignore pattern into a regex the way docker-py's
+    fnmatch does: * and ? do not match /, and ** matches any number of
+    directories.
+
+    >>> bool(re.match(_translate('a/*.py') + '$', 'a/b.py'))
+    True
+    >>> bool(re.match(_translate('a/*.py') + '$', 'a/b/c.py'))
+    False
+    >>> bool(re.match(_translate('**/*.py') + '$', 'a/b/c.py'))
+    True
+    """
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            if i < n and pattern[i] == '*':
+                i += 1
+                if i < n and pattern[i] == '/':
+                    i += 1
+                res.append('.*' if i >= n else '(.*/)?')
+            else:
+                res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                res.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] == '^':
+                    stuff = '\\' + stuff
+                res.append('[{}]'.format(stuff))
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+
+class _Patterns(object):
+    """
+    A list of .dockerignore patterns compiled into one regex per number of
+    path components they match, plus one for the patterns with **.
+
+    Like docker-py, matching ignores case, and a pattern without ** that
+    matches the first components of a path matches the whole path, so that
+    a pattern naming a directory matches everything below it.
+    """
+
+    def __init__(self, patterns):
+        by_depth = defaultdict(list)
+        deep = []
+        for pattern in patterns:
+            pattern = pattern.rstrip('/' + os.path.sep)
+            if pattern:
+                pattern = os.path.normpath(pattern)
+            components = pattern.split(os.path.sep)
+            regex = _translate('/'.join(components).lower())
+            if '**' in pattern:
+                deep.append(regex)
+            else:
+                by_depth[len(components)].append(regex)
+
+        def compile_(regexes):
+            return re.compile(
+                '(?:{})$'.format('|'.join(sorted(set(regexes)))),
+            ).match
+
+        self._by_depth = [
+            (depth, compile_(regexes))
+            for depth, regexes in sorted(by_depth.items())
+        ]
+        self._deep = compile_(deep) if deep else None
+
+    def __call__(self, path):
+        components = path.lower().split(os.path.sep)
+        for depth, match in self._by_depth:
+            if match('/'.join(components[:depth])):
+                return True
+        return bool(self._deep and self._deep('/'.join(components)))
+
+
+class Rules(object):
+    """
+    The rules of a .dockerignore, compiled once. The Dockerfile and the
+    .dockerignore itself are always exceptions, as in docker-py.
+    """
+
+    def __init__(self, patterns, dockerfile=None):
+        if dockerfile is None:
+            dockerfile = 'Dockerfile'
+
+        patterns = [p.lstrip('/') for p in patterns]
+        exceptions = [p for p in patterns if p.startswith('!')]
+        include = [p[1:] for p in exceptions] + [dockerfile, '.dockerignore']
+        exclude = set(patterns) - set(exceptions)
+
+        self._exclude = _Patterns(exclude) if exclude else None
+        self._include = _Patterns(include)
+        # the directories that an exception may re-include something below
+        self._exception_dirs = set()
+        for pattern in include:
+            pattern = pattern.replace(os.path.sep, '/') + '/'
+            self._exception_dirs.update(
+                pattern[:i] for i, c in enumerate(pattern) if c == '/'
+            )
+
+    def includes(self, path):
+        """
+        Whether path, relative to the context, goes in the context.
+        """
+        if self._exclude is None or not self._exclude(path):
+            return True
+        return self._include(path)
+
+    def walks(self, dir_path):
+        """
+        Whether anything below dir_path can go in the context, which is the
+        case when it is included itself or an exception names something
+        below it.
+        """
+        return (
+            dir_path.replace(os.path.sep, '/') in self._exception_dirs or
+            self.includes(dir_path)
+        )
+
+
+def exclude_paths(root, patterns, dockerfile=None):
+    """
+    Returns the set of the paths (relative to root) of every file and
+    directory under root that goes in the context given the .dockerignore
+    patterns, the same set that docker.utils.exclude_paths returns.
+
+    Directories that only hold ignored paths are never walked.
+    """
+    if dockerfile is None:
+        dockerfile = 'Dockerfile'
+    rules = Rules(patterns, dockerfile)
+
+    paths = set()
+    for parent, dirs, files in os.walk(root, topdown=True, followlinks=False):
+        parent = os.path.relpath(parent, root)
+        if parent == '.':
+            parent = ''
+
+        dirs[:] = [d for d in dirs if rules.walks(os.path.join(parent, d))]
+        for name in dirs + files:
+            path = os.path.join(parent, name)
+            if rules.includes(path):
+                paths.add(path)
+
+    if os.path.exists(os.path.join(root, dockerfile)):
+        # even when it is below an ignored directory
+        paths.add(dockerfile.replace('/', os.path.sep))
+    return paths
@@ -1,31 +1,69 @@
 from __future__ import absolute_import
 
-import json
 import os
-import re
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from . import dockerfile
 
 Image = namedtuple(
     'Image',
-    ['name', 'dir_path', 'path', 'parent', 'short_name', 'copy_paths'],
+    [
+        'name', 'dir_path', 'path', 'parent', 'short_name', 'copy_paths',
+        'parents',
+    ],
 )
 
-JSONDecodeError = getattr(json, 'JSONDecodeError', ValueError)
 
+# the Dockerfiles parsed at a time, opening files is mostly spent waiting
+# on slow (network) filesystems
+DISCOVERY_THREADS = 8
+
+
+def list_images(namespace, name_map, root_path, dockerfiles=None,
+                threads=DISCOVERY_THREADS, parse=dockerfile.load):
+    """
+    Lists the images built by the Dockerfiles under root_path, or by the
+    given dockerfiles paths, in that order. Up to threads Dockerfiles are
+    parsed concurrently, with parse (path -> dockerfile.Dockerfile).
+
+    The parent of an image is the first image it builds from that is also
+    built from this repository, or else the image of its first FROM line.
+    """
+    if dockerfiles is None:
+        dockerfiles = build_files(root_path)
+    dockerfiles = list(dockerfiles)
 
-def list_images(namespace, name_map, root_path):
-    images = []
-    for path in build_files(root_path):
+    def load_image(path):
         name, short_name = image_name(namespace, name_map, root_path, path)
-        images.append(Image(
+        parsed = parse(path)
+        return Image(
             name=name,
             short_name=short_name,
             dir_path=os.path.dirname(path),
-            copy_paths=copy_paths(path),
+            copy_paths=copy_paths(path, parsed),
             path=path,
-            parent=parent(path),
+            parent=parsed.parent,
+            parents=parsed.parents,
+        )
+
+    threads = min(threads, len(dockerfiles))
+    if threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            images = pool.map(load_image, dockerfiles)
+        finally:
+            pool.terminate()
+    else:
+        images = [load_image(path) for path in dockerfiles]
+
+    names = frozenset(c.name for c in images)
+    return [
+        c._replace(parent=next(
+            (p for p in c.parents if p in names), c.parent,
         ))
-    return images
+        for c in images
+    ]
 
 
 def image_name(namespace, name_map, root_path, path):
@@ -74,6 +112,7 @@ def build_files(build_root):
     >>> other = test_root.mkdir('other')
     >>> _ = other.mkdir('subdir1')
     >>> other.mkdir('subdir2').join('empty.txt').write('')
+    >>> test_root.mkdir('.git').join('Dockerfile').write('FROM ubuntu')
 
     >>> files = build_files(str(test_root))
     >>> sorted(files)  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
@@ -82,6 +121,8 @@ def build_files(build_root):
 
     """
     for root, dirs, files in os.walk(build_root):
+        if '.git' in dirs:
+            dirs.remove('.git')
         for filename in files:
             if filename.startswith('Dockerfile'):
                 yield os.path.join(root, filename)
@@ -120,45 +161,9 @@ def name(docker_path):
     return os.path.basename(os.path.dirname(docker_path)) + after
 
 
-def sub_if(ex, repl, string, flags):
-    """
-    Attempt a substitutuion and return the substituted string if there were
-    matches.
-    """
-    res = re.sub(ex, repl, string, count=1, flags=flags)
-    if res != string:
-        return res
-
-
-def parse_copy(cmd):
-    """
-    Parse the source directoreis from a docker COPY or ADD command
-
-    Ignores http or ftp URLs in ADD commands
-    """
-    copy = sub_if(r'^\s*(COPY)\s', '', cmd, re.I)
-    add = sub_if(r'^\s*(ADD)\s', '', cmd, re.I)
-
-    copy_cmd = copy or add
-    if not copy_cmd:
-        return []
-
-    try:
-        result = json.loads(copy_cmd)
-    except JSONDecodeError:
-        result = None
-
-    if not isinstance(result, list):
-        result = copy_cmd.split(' ')
-
-    paths = result[:-1]
-    if not add:
-        return paths
-
-    return [p for p in paths if not re.match('(https?|ftp):', p, re.I)]
-
-
-def copy_paths(docker_path):
+def copy_paths(docker_path, parsed=None):
+    if parsed is None:
+        parsed = dockerfile.load(docker_path)
     dirname = os.path.dirname(docker_path)
 
     def join(path):
@@ -168,10 +173,8 @@ def copy_paths(docker_path):
         yield docker_path
         yield join('.dockerignore')
 
-        with open(docker_path) as f:
-            for l in f:
-                for p in parse_copy(l):
-                    yield os.path.normpath(join(p))
+        for p in parsed.copy_sources:
+            yield os.path.normpath(join(p))
 
     return frozenset(copy_paths_gen())
 
@@ -185,6 +188,4 @@ def parent(docker_path):
     'ubuntu'
 
     """
-    for l in open(docker_path):
-        if l.strip().lower().startswith('from'):
-            return l.split()[1]
+    return dockerfile.load(docker_path).parent
@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+
+import os
+
+from . import dockerfile
+from .json_store import dump_entries, load_entries, stat_key
+
+
+def _entry_mtime(entry):
+    key = entry['key']
+    if key[0] == 'stat':
+        return key[1]
+
+
+class ImageIndex(object):
+    """
+    Remembers what every Dockerfile builds from and copies across runs, so
+    that an unchanged repository lists its images without reading any
+    Dockerfile.
+
+    A Dockerfile is known by the blob id git's index has for it when it has
+    no changes in the worktree, or else by its stat data (mtime, size and
+    inode). Entries keyed by an mtime that is not older than the index file
+    are never trusted (see json_store).
+
+    Parses loaded from the index have no content and no FROM spans, they
+    are only meant for listing images.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._seen = {}
+        self._changed = False
+
+    def load(self, docker_path, blob=None):
+        """
+        Returns the parse of the Dockerfile at docker_path, blob is its blob
+        id if it is unchanged from git's index.
+        """
+        if self._entries is None:
+            self._entries = load_entries(self.path, _entry_mtime)
+        if blob is not None:
+            key = ['blob', blob]
+        else:
+            key = ['stat'] + stat_key(os.stat(docker_path))
+
+        entry = self._entries.get(docker_path)
+        if entry is not None and entry['key'] == key:
+            self._seen[docker_path] = entry
+            return dockerfile.Dockerfile(
+                content=None,
+                parent=entry['parent'],
+                parents=tuple(entry['parents']),
+                copy_sources=tuple(entry['copy_sources']),
+                from_spans=(),
+            )
+
+        parsed = dockerfile.load(docker_path)
+        self._seen[docker_path] = {
+            'key': key,
+            'parent': parsed.parent,
+            'parents': list(parsed.parents),
+            'copy_sources': list(parsed.copy_sources),
+        }
+        self._changed = True
+        return parsed
+
+    def save(self):
+        """
+        Writes the Dockerfiles loaded since the last save, if any of them
+        had to be parsed or any Dockerfile went away.
+        """
+        entries = dict(self._seen)
+        self._seen = {}
+        if not self._changed and entries == (self._entries or {}):
+            return
+        entries = dump_entries(self.path, entries, _entry_mtime)
+        if entries is None:
+            return
+        self._entries = entries
+        self._changed = False
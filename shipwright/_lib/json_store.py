@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import json
+import os
+
+
+def mtime_ns(st):
+    """The modification time of the stat result st, in nanoseconds."""
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1e9)
+    return mtime_ns
+
+
+def stat_key(st):
+    """The stat data a file is known by: mtime, size and inode."""
+    return [mtime_ns(st), st.st_size, st.st_ino]
+
+
+def _write(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return mtime_ns(os.stat(path))
+
+
+def dump(path, data):
+    """
+    Writes data as json to path, creating its directory, through a
+    temporary file renamed over path so that readers never see a partial
+    file.
+
+    Returns False when it could not be written.
+    """
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        _write(tmp_path, data)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def _racy(entry_mtime, entry, file_mtime_ns):
+    """
+    Whether entry, kept in a file last modified at file_mtime_ns, is
+    "racily clean": keyed by an mtime (entry_mtime(entry), or None for
+    entries keyed by something else) that is not older than the file, so
+    that what it describes may have changed again within the same timestamp
+    granularity after the entry was made. Like git, such entries are never
+    trusted, and are dropped when written.
+    """
+    entry_mtime_ns = entry_mtime(entry)
+    return entry_mtime_ns is not None and entry_mtime_ns >= file_mtime_ns
+
+
+def load_entries(path, entry_mtime):
+    """
+    Returns the dict of entries kept in the json file at path, without the
+    racily clean ones. Any problem reading the file is treated as an empty
+    dict.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        file_mtime_ns = mtime_ns(os.stat(path))
+    except (IOError, OSError, ValueError):
+        return {}
+    return {
+        key: entry for key, entry in data.get('entries', {}).items()
+        if not _racy(entry_mtime, entry, file_mtime_ns)
+    }
+
+
+def dump_entries(path, entries, entry_mtime):
+    """
+    Writes the dict entries to the json file at path, like dump, leaving
+    out the entries that would be racily clean in it.
+
+    Returns the entries written, or None when they could not be written.
+    """
+    entries = dict(entries)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        file_mtime_ns = _write(tmp_path, {'entries': entries})
+        racy = [
+            key for key, entry in entries.items()
+            if _racy(entry_mtime, entry, file_mtime_ns)
+        ]
+        if racy:
+            for key in racy:
+                del entries[key]
+            _write(tmp_path, {'entries': entries})
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        return None
+    return entries
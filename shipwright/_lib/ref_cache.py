@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+
+import json
+import os
+
+from . import json_store
+
+
+class RefCache(object):
+    """
+    Persists the last commit found for each set of pathspecs, per HEAD
+    commit, as one small json file per HEAD under cache_dir.
+
+    A shallow clone only has part of the history, so the refs of a HEAD are
+    also keyed by its shallow state (a digest of .git/shallow, or None),
+    and are a miss under any other.
+
+    Only the most recently used max_heads HEADs are kept. Any problem
+    reading or writing the cache is treated as a cache miss.
+    """
+
+    def __init__(self, cache_dir, max_heads=64):
+        self.cache_dir = cache_dir
+        self.max_heads = max_heads
+
+    def _path(self, head):
+        return os.path.join(self.cache_dir, head + '.json')
+
+    def get(self, head, shallow=None):
+        """
+        Returns a dict of pathspecs -> hexsha (or None) known for head with
+        the shallow state shallow.
+        """
+        path = self._path(head)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return {}
+        if data.get('shallow') != shallow:
+            return {}
+        return {
+            tuple(pathspecs): sha for pathspecs, sha in data.get('refs', [])
+        }
+
+    def put(self, head, refs, shallow=None):
+        data = {
+            'head': head,
+            'shallow': shallow,
+            'refs': sorted([list(k), v] for k, v in refs.items()),
+        }
+        if json_store.dump(self._path(head), data):
+            self.prune()
+
+    def heads(self):
+        """
+        Returns the cached HEADs, most recently used first.
+        """
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return []
+
+        def mtime(head):
+            try:
+                return os.path.getmtime(self._path(head))
+            except OSError:
+                return 0
+
+        heads = [n[:-len('.json')] for n in names if n.endswith('.json')]
+        return sorted(heads, key=mtime, reverse=True)
+
+    def latest(self, exclude=None):
+        """
+        Returns the most recently used cached HEAD other than exclude, for
+        use as the base of an incremental computation.
+        """
+        for head in self.heads():
+            if head != exclude:
+                return head
+
+    def prune(self):
+        """
+        Removes all but the max_heads most recently used HEADs.
+        """
+        for head in self.heads()[self.max_heads:]:
+            try:
+                os.remove(self._path(head))
+            except OSError:
+                pass
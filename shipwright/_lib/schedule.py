@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+
+import heapq
+
+from . import dependencies
+
+# seconds expected of an image when no image has been built before
+DEFAULT_ESTIMATE = 1.0
+
+
+def estimates(targets, durations):
+    """
+    Returns the seconds each of targets is expected to take to build, from
+    durations (image name -> seconds of its last build). Images without a
+    previous build are expected to take the mean of the known durations.
+    """
+    known = [durations[t.name] for t in targets if t.name in durations]
+    default = sum(known) / len(known) if known else DEFAULT_ESTIMATE
+    return {t.name: durations.get(t.name, default) for t in targets}
+
+
+def priorities(targets, estimates):
+    """
+    Returns, for each of targets, the estimated seconds of the longest chain
+    of builds starting with it and going through its dependents. The
+    targets at the head of the longest chains should be started first.
+
+    >>> from collections import namedtuple
+    >>> T = namedtuple('T', ['name', 'parent', 'parents', 'short_name'])
+    >>> ts = [
+    ...     T('base', 'ubuntu', ('ubuntu',), 'base'),
+    ...     T('slow', 'base', ('base',), 'slow'),
+    ...     T('fast', 'base', ('base',), 'fast'),
+    ... ]
+    >>> sorted(priorities(ts, {'base': 1, 'slow': 5, 'fast': 2}).items())
+    [('base', 6), ('fast', 2), ('slow', 5)]
+    """
+    children = {t.name: [] for t in targets}
+    for parent, child in dependencies.edges(targets):
+        children[parent.name].append(child.name)
+
+    results = {}
+    for level in reversed(dependencies.levels(targets)):
+        for t in level:
+            results[t.name] = estimates[t.name] + max(
+                [results[c] for c in children[t.name]] or [0],
+            )
+    return results
+
+
+def simulate(targets, estimates, priority, jobs):
+    """
+    Plays a build of targets on jobs workers with the given estimates,
+    starting ready targets by highest priority (and then in the order of
+    targets), the way build._parallel_build does.
+
+    Returns the predicted makespan in seconds and a list of (target, start)
+    in the order the targets start.
+    """
+    position = {t.name: i for i, t in enumerate(targets)}
+    waiting_on = {t.name: set() for t in targets}
+    children = {t.name: [] for t in targets}
+    for parent, child in dependencies.edges(targets):
+        waiting_on[child.name].add(parent.name)
+        children[parent.name].append(child)
+
+    def key(t):
+        return (-priority[t.name], position[t.name])
+
+    ready = [(key(t), t) for t in targets if not waiting_on[t.name]]
+    heapq.heapify(ready)
+    running = []
+    now = 0.0
+    started = []
+    while ready or running:
+        while ready and len(running) < max(jobs, 1):
+            _, t = heapq.heappop(ready)
+            started.append((t, now))
+            end = now + estimates[t.name]
+            heapq.heappush(running, (end, position[t.name], t))
+        if not running:
+            break
+        now, _, done = heapq.heappop(running)
+        for child in children[done.name]:
+            waiting_on[child.name].discard(done.name)
+            if not waiting_on[child.name]:
+                heapq.heappush(ready, (key(child), child))
+    return now, started
+
+
+def explain(targets, durations, jobs):
+    """
+    Returns the lines explaining how targets will be scheduled on jobs
+    workers: the predicted makespan, then every target in the order it
+    starts, with its estimate and the longest chain it heads. A single job
+    builds targets in their order, whatever their priorities.
+    """
+    est = estimates(targets, durations)
+    priority = priorities(targets, est)
+    order = priority if jobs > 1 else {t.name: 0 for t in targets}
+    makespan, started = simulate(targets, est, order, jobs)
+    lines = [
+        'Predicted makespan: {:.1f}s with {} job(s)'.format(makespan, jobs),
+    ]
+    for i, (t, start) in enumerate(started):
+        lines.append(
+            '{:>4}. {} starts at {:.1f}s, takes {:.1f}s{}, '
+            'longest chain {:.1f}s'.format(
+                i + 1, t.name, start, est[t.name],
+                '' if t.name in durations else ' (estimated)',
+                priority[t.name],
+            ),
+        )
+    return lines
@@ -2,14 +2,21 @@ from __future__ import absolute_import
 
 import binascii
 import fnmatch
+import functools
 import hashlib
+import itertools
+import operator
 import os.path
 import re
+import subprocess
+import threading
+import time
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 import git
 
-from . import image
+from . import compat, image, image_index, ref_cache, stat_cache
 
 
 class Mode(object):
@@ -25,6 +32,13 @@ SOURCE_CONTROL = [
 ]
 
 
+# How a target's ref is derived from its lineage's copy paths: the last
+# commit touching them, or a digest of their content in HEAD's tree.
+COMMIT_REFS = 'commit'
+TREE_REFS = 'tree'
+REF_MODES = (COMMIT_REFS, TREE_REFS)
+
+
 class SourceControlNotFound(Exception):
     def __init__(self):
         possible_values = ', '.join([x for x, _ in SOURCE_CONTROL])
@@ -32,14 +46,399 @@ class SourceControlNotFound(Exception):
         super(SourceControlNotFound, self).__init__(msg)
 
 
-def _last_commit(repo, paths):
-    commits = repo.iter_commits(
-        paths=paths,
-        max_count=1,
-        topo_order=True,
+class _PathMatcher(object):
+    """
+    Matches repository relative paths against a set of paths compiled
+    once: exact paths and whole directories are looked up in sets, one
+    leading directory at a time, and every glob goes into a single regex.
+    """
+
+    def __init__(self, exact=(), dirs=(), globs=(), everything=False):
+        self._exact = frozenset(exact)
+        self._dirs = frozenset(dirs)
+        self._glob = None
+        if globs:
+            pattern = '|'.join(fnmatch.translate(g) for g in sorted(globs))
+            self._glob = re.compile(pattern).match
+        self._everything = everything
+
+    def __call__(self, path):
+        if self._everything or path in self._exact:
+            return True
+        if self._dirs:
+            i = path.rfind('/')
+            while i > 0:
+                if path[:i] in self._dirs:
+                    return True
+                i = path.rfind('/', 0, i)
+        return bool(self._glob and self._glob(path))
+
+
+_GIT_GLOB_CHARS = re.compile(r'[*?[\\]')
+
+
+def _pathspec_matcher(pathspecs):
+    """
+    Compiles repository relative pathspecs into a _PathMatcher that behaves
+    like git's default (magic-less) pathspecs.
+
+    >>> match = _pathspec_matcher(['base', 'src/*.js'])
+    >>> match('base/Dockerfile'), match('base-dev/Dockerfile')
+    (True, False)
+    >>> match('src/lib/foo.js'), match('src/foo.css')
+    (True, False)
+    >>> _pathspec_matcher(['.'])('anything')
+    True
+    """
+    return _PathMatcher(
+        exact=pathspecs,
+        dirs=pathspecs,
+        globs=[p for p in pathspecs if _GIT_GLOB_CHARS.search(p)],
+        everything='.' in pathspecs,
+    )
+
+
+def _relpath(repo_wd, path):
+    rel = os.path.relpath(_abspath(repo_wd, path), repo_wd)
+    return rel.replace(os.sep, '/')
+
+
+def _pathspecs(repo_wd, paths):
+    return tuple(sorted(frozenset(_relpath(repo_wd, p) for p in paths)))
+
+
+def _log_records(repo, revs):
+    """
+    Yields (hexsha, tree, parents, changed_paths) for every commit selected
+    by revs, newest first, in topological order.
+
+    Merge commits are yielded once per parent whose tree differs from the
+    merge's tree, in parent order.
+    """
+    proc = repo.git.log(
+        '--topo-order', '--root', '-m', '--no-renames',
+        '--no-show-signature', '--name-only', '-z',
+        '--format=%x01%H %T %P', *revs,
+        as_process=True
+    )
+
+    def record(chunk):
+        header, _, paths = chunk.partition(b'\0')
+        fields = header.decode('ascii').split()
+        changed = frozenset(
+            compat.fsdecode(p)
+            for p in paths.lstrip(b'\n').split(b'\0') if p
+        )
+        return fields[0], fields[1], fields[2:], changed
+
+    buf = b''
+    while True:
+        data = proc.stdout.read(65536)
+        if not data:
+            break
+        chunks = (buf + data).split(b'\x01')
+        buf = chunks.pop()
+        for chunk in chunks:
+            if chunk:
+                yield record(chunk)
+    if buf:
+        yield record(buf)
+
+
+# commits diffed by one git diff-tree process when walking in parallel
+_HISTORY_CHUNK = 256
+
+_worker = threading.local()
+
+
+def _diff_commits(repo_path, commits):
+    """
+    Runs in a worker thread: diffs each (hexsha, parents) in commits
+    against each of its parents with one `git diff-tree --stdin`.
+
+    GitPython objects are not thread-safe, so every worker thread opens
+    its own git.Repo.
+    """
+    if getattr(_worker, 'repo', None) is None:
+        _worker.repo = git.Repo(repo_path)
+    repo = _worker.repo
+
+    pairs = [
+        (sha, parent) for sha, parents in commits
+        for parent in (parents or [None])
+    ]
+    stdin = ''.join(
+        sha + ('\n' if parent is None else ' ' + parent + '\n')
+        for sha, parent in pairs
+    ).encode('ascii')
+    proc = repo.git.diff_tree(
+        '--stdin', '-r', '--root', '--no-renames', '--always',
+        '--name-only', '-z',
+        as_process=True, istream=subprocess.PIPE,
     )
-    for commit in commits:
-        return commit
+    out, err = proc.communicate(stdin)
+    if proc.returncode != 0:
+        raise git.GitCommandError(proc.args, proc.returncode, err)
+
+    # --always prints every pair's commit id, even when nothing changed
+    tokens = iter(compat.fsdecode(out).split('\0')[:-1])
+    headers = [sha for sha, _ in pairs[1:]] + [None]
+    changes = []
+    token = next(tokens, None)
+    for header in headers:
+        paths = []
+        token = next(tokens, None)
+        while token is not None and token != header:
+            paths.append(token)
+            token = next(tokens, None)
+        changes.append(frozenset(paths))
+
+    changes = iter(changes)
+    return [
+        (sha, None, parents, [next(changes) for _ in (parents or [None])])
+        for sha, parents in commits
+    ]
+
+
+def _parallel_history(repo, revs, jobs):
+    """
+    Same as _history, but the diffs are computed by jobs git processes
+    at a time, each diffing a chunk of the commits listed by rev-list.
+    """
+    rev_list = repo.git.rev_list('--topo-order', '--parents', *revs)
+    commits = [line.split() for line in rev_list.splitlines()]
+    chunks = [
+        [(c[0], c[1:]) for c in commits[i:i + _HISTORY_CHUNK]]
+        for i in range(0, len(commits), _HISTORY_CHUNK)
+    ]
+    diff_chunk = functools.partial(_diff_commits, repo.working_dir)
+
+    pool = ThreadPool(jobs)
+    try:
+        for chunk in pool.imap(diff_chunk, chunks):
+            for commit in chunk:
+                yield commit
+    finally:
+        pool.terminate()
+
+
+def _history(repo, revs, jobs=1):
+    """
+    Yields (hexsha, tree, parents, changes) for every commit selected by
+    revs, newest first, in topological order. changes holds one set of
+    changed paths for every record `git log -m` printed for the commit.
+    """
+    if jobs > 1:
+        for commit in _parallel_history(repo, revs, jobs):
+            yield commit
+        return
+
+    key = operator.itemgetter(0)
+    for sha, records in itertools.groupby(_log_records(repo, revs), key):
+        records = list(records)
+        _, tree, parents, _ = records[0]
+        yield sha, tree, parents, [r[3] for r in records]
+
+
+def _changes_per_parent(repo, tree, parents, changes):
+    """
+    Pairs up the changes of a commit with its parents, a root commit is
+    paired with None (the empty tree).
+    """
+    if not parents:
+        return [(None, changes[0])]
+    if len(changes) == len(parents):
+        return list(zip(parents, changes))
+    # git log -m stays silent about parents with an identical tree
+    rest = iter(changes)
+    return [
+        (p, frozenset() if repo.commit(p).tree.hexsha == tree else next(rest))
+        for p in parents
+    ]
+
+
+def _walk(repo, waiting, revs, jobs=1):
+    """
+    Follows the simplified history of every tuple of pathspecs in waiting,
+    a dict of hexsha -> specs whose history continues at that commit, over
+    the commits selected by revs.
+
+    History simplification is followed per spec: a commit that changes
+    none of the paths is skipped, a merge that is TREESAME to one of its
+    parents is skipped in favour of the first such parent. The walk stops
+    as soon as every spec has found its commit.
+
+    Returns a dict of spec -> hexsha for the specs that found their commit.
+    waiting is updated in place with the specs whose history continues
+    outside of revs.
+    """
+    found = {}
+    matchers = {}
+    for sha, tree, parents, changes in _history(repo, revs, jobs):
+        pending = waiting.pop(sha, None)
+        if not pending:
+            continue
+        per_parent = _changes_per_parent(repo, tree, parents, changes)
+        for spec in pending:
+            if spec not in matchers:
+                matchers[spec] = _pathspec_matcher(spec)
+            match = matchers[spec]
+            treesame = [
+                parent for parent, changed in per_parent
+                if not any(match(p) for p in changed)
+            ]
+            if not treesame:
+                found[spec] = sha
+            elif treesame[0] is not None:
+                waiting.setdefault(treesame[0], set()).add(spec)
+        if not waiting:
+            break
+    return found
+
+
+def _last_commits(repo, specs, jobs=1):
+    """
+    Finds the last commit touching each tuple of pathspecs in specs, as
+    `git rev-list --topo-order --max-count=1 HEAD -- <paths>` would, but
+    with one walk of the history shared by every entry. With jobs > 1
+    the history is diffed by that many git processes in parallel.
+
+    Returns a list of hexshas (or None when no commit matches) in the order
+    of specs.
+    """
+    if not specs:
+        return []
+    waiting = {repo.head.commit.hexsha: set(specs)}
+    found = _walk(repo, waiting, ['HEAD'], jobs)
+    return [found.get(spec) for spec in specs]
+
+
+def _is_ancestor(repo, ancestor, rev):
+    try:
+        return repo.is_ancestor(ancestor, rev)
+    except git.GitCommandError:
+        # e.g. ancestor no longer exists after a rebase and gc
+        return False
+
+
+def _shallow_state(repo):
+    """
+    Returns a digest of the shallow commits of repo, or None when it is not
+    a shallow clone. Deepening or unshallowing a clone changes the history
+    that refs are found in.
+    """
+    git_dir = getattr(repo, 'common_dir', repo.git_dir)
+    try:
+        with open(os.path.join(git_dir, 'shallow'), 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def _last_commits_since(repo, specs, base, base_commits, jobs=1):
+    """
+    Same as _last_commits, but reuses base_commits, a snapshot of
+    spec -> hexsha computed at the commit base, so that only the commits
+    in base..HEAD are walked. Specs unknown to the snapshot, or whose
+    history leaves base..HEAD elsewhere than at base, carry on walking
+    from where they left off.
+
+    Falls back to a full walk when base is not an ancestor of HEAD.
+    """
+    head = repo.head.commit.hexsha
+    if not specs:
+        return []
+    if not _is_ancestor(repo, base, head):
+        return _last_commits(repo, specs, jobs)
+
+    waiting = {head: set(specs)}
+    found = _walk(repo, waiting, [head, '^' + base], jobs)
+    for spec in waiting.pop(base, ()):
+        if spec in base_commits:
+            found[spec] = base_commits[spec]
+        else:
+            waiting.setdefault(base, set()).add(spec)
+    if waiting:
+        found.update(_walk(repo, waiting, sorted(waiting), jobs))
+    return [found.get(spec) for spec in specs]
+
+
+class _TreeIndex(object):
+    """
+    Looks up the entries of a git tree by path, reading every subtree at
+    most once.
+    """
+
+    def __init__(self, tree):
+        self._root = tree
+        self._children = {}
+
+    def _children_of(self, dir_path):
+        if dir_path not in self._children:
+            tree = self.get(dir_path)
+            if tree is None or tree.type != 'tree':
+                self._children[dir_path] = {}
+            else:
+                self._children[dir_path] = {o.name: o for o in tree}
+        return self._children[dir_path]
+
+    def get(self, path):
+        if path in ('', '.'):
+            return self._root
+        dir_path, _, name = path.rpartition('/')
+        return self._children_of(dir_path).get(name)
+
+    def blobs(self, dir_path):
+        """
+        Yields every entry below dir_path that is not a tree.
+        """
+        for obj in self._children_of(dir_path).values():
+            if obj.type == 'tree':
+                for blob in self.blobs(obj.path):
+                    yield blob
+            else:
+                yield obj
+
+
+def _tree_digest(index, spec):
+    """
+    Digests the modes and object ids of every entry of the tree matching
+    the pathspecs of spec. Returns None if nothing matches.
+    """
+    entries = set()
+    for path in spec:
+        obj = index.get(path)
+        if obj is not None:
+            entries.add((path, obj.mode, obj.hexsha))
+        glob = _GIT_GLOB_CHARS.search(path)
+        if glob:
+            dir_path = path[:glob.start()].rpartition('/')[0]
+            for blob in index.blobs(dir_path):
+                if fnmatch.fnmatchcase(blob.path, path):
+                    entries.add((blob.path, blob.mode, blob.hexsha))
+
+    if not entries:
+        return None
+
+    digest = hashlib.sha256()
+    for path, mode, hexsha in sorted(entries):
+        line = '{:o} {} {}\0'.format(mode, hexsha, path)
+        digest.update(line.encode('utf-8'))
+    return binascii.hexlify(digest.digest()).decode('utf-8')
+
+
+def _tree_digests(repo, specs):
+    """
+    Content based alternative to _last_commits: digests what each tuple of
+    pathspecs in specs points at in HEAD's tree. Needs no history, so it
+    works in shallow clones, and reverting a change gives back the old
+    digest.
+
+    Returns a list of hex digests (or None when nothing matches) in the
+    order of specs.
+    """
+    index = _TreeIndex(repo.head.commit.tree)
+    return [_tree_digest(index, spec) for spec in specs]
 
 
 _Target = namedtuple('Target', ['image', 'ref', 'children'])
@@ -58,71 +457,185 @@ class Target(_Target):
     def parent(self):
         return self.image.parent
 
+    @property
+    def parents(self):
+        return self.image.parents
+
     @property
     def path(self):
         return self.image.path
 
+    @property
+    def copy_paths(self):
+        return self.image.copy_paths
+
 
 del _Target
 
 
 def _image_parents(index, image):
-    while image:
+    """
+    Yields image and every image of index it is built from, directly or
+    through other images.
+    """
+    seen = set()
+    todo = [image]
+    while todo:
+        image = todo.pop()
+        if image is None or image.name in seen:
+            continue
+        seen.add(image.name)
         yield image
-        image = index.get(image.parent)
+        todo.extend(index.get(p) for p in reversed(image.parents))
 
 
 def _hexsha(ref):
     if ref is not None:
-        return ref.hexsha[:12]
+        return ref[:12]
     else:
         return 'g' * 12
 
 
-def _hash_blob(blob):
-    if blob.hexsha != blob.NULL_HEX_SHA:
-        return blob.hexsha
-    else:
-        return blob.repo.git.hash_object(blob.abspath)
-
+def _hash_objects(repo, paths):
+    """
+    Hashes worktree files the way `git hash-object` does (filters included),
+    using one git process for all of them.
 
-def _hash_blobs(blobs):
-    return [(b.path, _hash_blob(b)) for b in blobs if b]
+    Returns a dict of path -> hexsha.
+    """
+    if not paths:
+        return {}
+    proc = repo.git.hash_object(
+        '--stdin-paths', as_process=True, istream=subprocess.PIPE,
+    )
+    stdin = ''.join(p + '\n' for p in paths).encode('utf-8')
+    out, err = proc.communicate(stdin)
+    if proc.returncode != 0:
+        raise git.GitCommandError(proc.args, proc.returncode, err)
+    return dict(zip(paths, out.decode('ascii').split()))
+
+
+def _hash_files(repo, paths, cache=None):
+    """
+    Like _hash_objects, but only hashes the files whose stat data changed
+    since the stat cache last saw them.
+    """
+    if cache is None:
+        return _hash_objects(repo, paths)
+
+    hashes = {}
+    stats = {}
+    for path in paths:
+        try:
+            st = os.stat(os.path.join(repo.working_dir, path))
+        except OSError:
+            st = None
+        else:
+            hexsha = cache.get(path, st)
+            if hexsha is not None:
+                hashes[path] = hexsha
+                continue
+        stats[path] = st
+
+    hashed = _hash_objects(repo, sorted(stats))
+    for path, hexsha in hashed.items():
+        if stats[path] is not None:
+            cache.set(path, stats[path], hexsha)
+    cache.save()
+
+    hashes.update(hashed)
+    return hashes
+
+
+def _hash_blobs(blobs, worktree_hashes):
+    return [
+        (b.path, worktree_hashes[b.path] if b.hexsha == b.NULL_HEX_SHA
+         else b.hexsha)
+        for b in blobs if b
+    ]
 
 
 def _abspath(repo_wd, path):
     return os.path.abspath(os.path.join(repo_wd, path))
 
 
-def _in_paths(repo_wd, base_paths, path):
-    wd = repo_wd
-    p = _abspath(repo_wd, path)
+_FNMATCH_CHARS = re.compile(r'[*?[]')
+
+
+def _paths_matcher(repo_wd, base_paths):
+    """
+    Compiles base_paths (absolute or relative to repo_wd) into a
+    _PathMatcher for repository relative paths. A path matches when it is
+    one of base_paths or lies below one of them, glob entries match
+    anything below a path matching the glob.
+
+    >>> match = _paths_matcher('/repo', ['/repo/base', '/repo/src/*.js'])
+    >>> match('base'), match('base/Dockerfile'), match('based')
+    (True, True, False)
+    >>> match('src/a.js/b'), match('src/a.js')
+    (True, False)
+    >>> _paths_matcher('/repo', ['.'])('anything')
+    True
+    """
+    rel_paths = [_relpath(repo_wd, p) for p in base_paths]
+    return _PathMatcher(
+        exact=rel_paths,
+        dirs=[p for p in rel_paths if not _FNMATCH_CHARS.search(p)],
+        globs=[p + '/*' for p in rel_paths if _FNMATCH_CHARS.search(p)],
+        everything='.' in rel_paths,
+    )
+
 
-    for base_path in base_paths:
-        path_pattern = _abspath(wd, base_path)
-        if not re.match('[*?]', path_pattern):
-            if p == path_pattern:
-                return True
-            extra = '*' if path_pattern.endswith(os.sep) else os.sep + '*'
-            path_pattern += extra
+def copy_paths_matcher(root, copy_paths):
+    """
+    Compiles copy_paths (absolute or relative to root), the sources an
+    image copies (see image.copy_paths), into a matcher of the paths
+    relative to root that docker copies from them. Like _paths_matcher, but
+    a glob matches the paths it matches too, not only anything below them,
+    the way COPY copies a directory that a glob matches whole.
+
+    >>> match = copy_paths_matcher('/repo', ['/repo/base', '/repo/src/*.js'])
+    >>> match('base/Dockerfile'), match('src/a.js'), match('src/a.js/b')
+    (True, True, True)
+    >>> match('src/a.css')
+    False
+    """
+    rel_paths = [_relpath(root, p) for p in copy_paths]
+    globs = [p for p in rel_paths if _FNMATCH_CHARS.search(p)]
+    return _PathMatcher(
+        exact=rel_paths,
+        dirs=[p for p in rel_paths if not _FNMATCH_CHARS.search(p)],
+        globs=globs + [p + '/*' for p in globs],
+        everything='.' in rel_paths,
+    )
 
-        if fnmatch.fnmatch(p, path_pattern):
-            return True
-    return False
 
+def _dirty_state(repo, cache=None):
+    """
+    Takes a snapshot of the uncommitted changes in the repository.
 
-def _dirty_suffix(repo, base_paths=['.']):
-    repo_wd = repo.working_dir
+    Returns a list of (path, hexsha) pairs: the HEAD side of every changed
+    path followed by the worktree side of every changed or untracked path.
+    """
     diff = repo.head.commit.diff(None)
-    a_hashes = _hash_blobs(d.a_blob for d in diff)
-    b_hashes = _hash_blobs(d.b_blob for d in diff)
-
     u_files = repo.untracked_files
-    untracked_hashes = [(path, repo.git.hash_object(path)) for path in u_files]
+    blobs = [b for d in diff for b in (d.a_blob, d.b_blob) if b]
+    worktree_paths = frozenset(
+        [b.path for b in blobs if b.hexsha == b.NULL_HEX_SHA] + u_files,
+    )
+    worktree_hashes = _hash_files(repo, sorted(worktree_paths), cache)
+
+    a_hashes = _hash_blobs((d.a_blob for d in diff), worktree_hashes)
+    b_hashes = _hash_blobs((d.b_blob for d in diff), worktree_hashes)
+    untracked_hashes = [(path, worktree_hashes[path]) for path in u_files]
+
+    return sorted(a_hashes) + sorted(b_hashes + untracked_hashes)
+
 
-    hashes = sorted(a_hashes) + sorted(b_hashes + untracked_hashes)
+def _dirty_suffix(dirty_state, matchers):
     filtered_hashes = [
-        (path, h) for path, h in hashes if _in_paths(repo_wd, base_paths, path)
+        (path, h) for path, h in dirty_state
+        if any(match(path) for match in matchers)
     ]
 
     if not filtered_hashes:
@@ -134,6 +647,60 @@ def _dirty_suffix(repo, base_paths=['.']):
     return '-dirty-' + binascii.hexlify(digest.digest())[:12].decode('utf-8')
 
 
+def _ls_files(repo, path, *args):
+    """
+    Lists the files in git's index, and any other files the extra
+    `git ls-files` args ask for, that exist in the worktree.
+
+    Returns a list of (path, blob) sorted by path, where blob is the blob id
+    in git's index of a file without changes in the worktree, or None.
+    """
+    out = repo.git.ls_files(
+        '-z', '-t', '--stage', '--cached', '--modified', '--deleted', *args
+    )
+    blobs = {}
+    changed = set()
+    deleted = set()
+    for record in out.split('\0'):
+        if not record:
+            continue
+        tag, _, rest = record.partition(' ')
+        if tag == '?':
+            changed.add(rest)
+            continue
+        info, _, rel_path = rest.partition('\t')
+        _, blob, stage = info.split()
+        if tag == 'R':
+            deleted.add(rel_path)
+        elif tag == 'H' and stage == '0':
+            blobs[rel_path] = blob
+        else:
+            changed.add(rel_path)
+
+    results = []
+    for rel_path in sorted((frozenset(blobs) | changed) - deleted):
+        p = os.path.join(path, *rel_path.split('/'))
+        if rel_path in changed:
+            # unmerged or outside of a sparse checkout
+            if os.path.isfile(p):
+                results.append((p, None))
+        else:
+            results.append((p, blobs[rel_path]))
+    return results
+
+
+def _dockerfiles(repo, path):
+    """
+    Lists the Dockerfiles that are either tracked or untracked but not
+    ignored, from git's index rather than by walking the worktree, see
+    _ls_files.
+    """
+    return _ls_files(
+        repo, path, '--others', '--exclude-standard',
+        ':(glob)**/Dockerfile*',
+    )
+
+
 class SourceControl(object):
     pass
 
@@ -141,15 +708,44 @@ class SourceControl(object):
 class GitSourceControl(SourceControl):
     mode = GIT
 
-    def __init__(self, path, namespace, name_map):
+    def __init__(self, path, namespace, name_map, ref_mode=None, jobs=1):
+        if ref_mode is None:
+            ref_mode = COMMIT_REFS
+        if ref_mode not in REF_MODES:
+            raise ValueError('ref_mode must be one of {}, not {!r}'.format(
+                ', '.join(REF_MODES), ref_mode,
+            ))
         self.path = path
+        self.ref_mode = ref_mode
+        self.jobs = jobs
         self._namespace = namespace
         self._name_map = name_map
+        # seconds spent by the last call to images()
+        self.discovery_time = None
         self._repo = git.Repo(path)
+        self.cache_dir = cache_dir = os.path.join(
+            self._repo.git_dir, 'shipwright',
+        )
+        self._ref_cache = ref_cache.RefCache(os.path.join(cache_dir, 'refs'))
+        self._stat_cache = stat_cache.StatCache(
+            os.path.join(cache_dir, 'stat-cache.json'),
+        )
+        self._image_index = image_index.ImageIndex(
+            os.path.join(cache_dir, 'images.json'),
+        )
 
-    def is_dirty(self):
-        repo = self._repo
-        return bool(repo.untracked_files or repo.head.commit.diff(None))
+    def dirty_state(self):
+        """
+        Takes a snapshot of the uncommitted changes in the repository, to be
+        shared by is_dirty, targets and this_ref_str within one run.
+        """
+        return _dirty_state(self._repo, self._stat_cache)
+
+    def is_dirty(self, dirty_state=None):
+        if dirty_state is None:
+            repo = self._repo
+            return bool(repo.untracked_files or repo.head.commit.diff(None))
+        return bool(dirty_state)
 
     def default_tags(self):
         repo = self._repo
@@ -159,27 +755,104 @@ class GitSourceControl(SourceControl):
         branch = repo.active_branch.name
         return [branch]
 
-    def this_ref_str(self):
-        return _hexsha(self._repo.commit()) + _dirty_suffix(self._repo)
-
-    def targets(self):
+    def this_ref_str(self, dirty_state=None):
         repo = self._repo
-
+        if dirty_state is None:
+            dirty_state = self.dirty_state()
+        matchers = [_paths_matcher(repo.working_dir, ['.'])]
+        return (_hexsha(repo.head.commit.hexsha) +
+                _dirty_suffix(dirty_state, matchers))
+
+    def _last_commits(self, specs):
+        head = self._repo.head.commit.hexsha
+        shallow = _shallow_state(self._repo)
+        known = self._ref_cache.get(head, shallow)
+        missing = sorted(frozenset(specs) - frozenset(known))
+        if missing:
+            base = self._ref_cache.latest(exclude=head)
+            if base is None:
+                commits = _last_commits(self._repo, missing, self.jobs)
+            else:
+                commits = _last_commits_since(
+                    self._repo, missing, base,
+                    self._ref_cache.get(base, shallow), self.jobs,
+                )
+            known.update(zip(missing, commits))
+            self._ref_cache.put(head, known, shallow)
+        return [known[spec] for spec in specs]
+
+    def blob_ids(self):
+        """
+        Returns a dict of the path of every file without changes from git's
+        index -> its blob id there.
+        """
+        return {
+            p: blob for p, blob in _ls_files(self._repo, self.path)
+            if blob is not None
+        }
+
+    def images(self):
+        start = time.time()
+        dockerfiles = _dockerfiles(self._repo, self.path)
+        blobs = dict(dockerfiles)
         images = image.list_images(
             self._namespace,
             self._name_map,
             self.path,
+            [p for p, _ in dockerfiles],
+            parse=lambda p: self._image_index.load(p, blobs[p]),
         )
-        c_index = {c.name: c for c in images}
+        self._image_index.save()
+        self.discovery_time = time.time() - start
+        return images
+
+    def targets(self, images=None, names=None, dirty_state=None):
+        """
+        Returns a Target for every image, or only for the images named in
+        names, in the order of images (which defaults to every image in the
+        repository). Refs are only computed for the returned targets, from
+        dirty_state, or a new snapshot of the uncommitted changes.
+        """
+        repo = self._repo
 
-        targets = []
+        if images is None:
+            images = self.images()
+        c_index = {c.name: c for c in images}
+        if names is not None:
+            names = frozenset(names)
+            images = [c for c in images if c.name in names]
 
-        for c in images:
-            paths = sorted(frozenset.union(
+        paths_list = [
+            sorted(frozenset.union(
                 *(p.copy_paths for p in _image_parents(c_index, c))
             ))
-            ref = (_hexsha(_last_commit(repo, paths)) +
-                   _dirty_suffix(repo, paths))
+            for c in images
+        ]
+        specs = [_pathspecs(repo.working_dir, paths) for paths in paths_list]
+        if self.ref_mode == TREE_REFS:
+            refs = _tree_digests(repo, specs)
+        else:
+            refs = self._last_commits(specs)
+
+        if dirty_state is None:
+            dirty_state = self.dirty_state()
+        # compiled once per image, shared by every image in its lineage
+        matchers = {}
+
+        def matcher(c):
+            if c.name not in matchers:
+                matchers[c.name] = _paths_matcher(
+                    repo.working_dir, c.copy_paths,
+                )
+            return matchers[c.name]
+
+        targets = []
+
+        for c, base_ref in zip(images, refs):
+            suffix = _dirty_suffix(dirty_state, [
+                matcher(p) for p in _image_parents(c_index, c)
+            ])
+            ref = _hexsha(base_ref) + suffix
             targets.append(Target(image=c, ref=ref, children=None))
 
         return targets
@@ -192,11 +865,12 @@ def get_mode(path):
     raise SourceControlNotFound()
 
 
-def source_control(path, namespace, name_map, mode=None):
+def source_control(path, namespace, name_map, mode=None, ref_mode=None,
+                   jobs=1):
     if mode is None:
         mode = AUTO
     assert isinstance(mode, Mode)
     the_mode = mode if mode is not AUTO else get_mode(path)
     for cls in SourceControl.__subclasses__():
         if cls.mode is the_mode:
-            return cls(path, namespace, name_map)
+            return cls(path, namespace, name_map, ref_mode, jobs)
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import operator
+
+from .json_store import dump_entries, load_entries, stat_key
+
+# entries are [mtime_ns, size, inode, hexsha]
+_entry_mtime = operator.itemgetter(0)
+
+
+class StatCache(object):
+    """
+    Remembers the blob hash of worktree files across runs, keyed by their
+    stat data (mtime, size and inode), much like git's own index.
+
+    Entries whose mtime is not older than the cache file itself are
+    "racily clean": the file may have changed again within the same
+    timestamp granularity after it was hashed. Like git, those entries are
+    never trusted and are dropped when the cache is written.
+
+    Only the paths looked up since the cache was loaded are written back,
+    so the cache does not outgrow the set of dirty files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._seen = {}
+        self._changed = False
+
+    def get(self, path, st):
+        """
+        Returns the cached hash of path if st matches its stat data.
+        """
+        if self._entries is None:
+            self._entries = load_entries(self.path, _entry_mtime)
+        entry = self._entries.get(path)
+        if entry is not None and entry[:3] == stat_key(st):
+            self._seen[path] = entry
+            return entry[3]
+
+    def set(self, path, st, hexsha):
+        self._seen[path] = stat_key(st) + [hexsha]
+        self._changed = True
+
+    def save(self):
+        """
+        Writes the paths looked up since the last save, if any of them had
+        to be hashed or any entry went away.
+        """
+        if not self._changed and self._seen == (self._entries or {}):
+            self._seen = {}
+            return
+        entries = dump_entries(self.path, self._seen, _entry_mtime)
+        if entries is None:
+            return
+        self._entries = entries
+        self._seen = {}
+        self._changed = False
@@ -1,30 +1,206 @@
 from __future__ import absolute_import
 
+import hashlib
 import io
 import os
-import re
+import stat
 import tarfile
+import time
+from collections import namedtuple
 from os.path import join
 
-from docker import utils
+from . import dockerfile, dockerignore, source_control
 
-RE_DOCKER_TAG = re.compile(
-    r'^(?P<from>\s*from\s+)'
-    r'(?P<registry>[\w.-]+(?P<port>:\d+)?(?P<path>([\w.-]+/)+|/))?'
-    r'(?P<name>[\w.-]+)'
-    r'(?P<whitespace>(\s*))$',
-    flags=re.MULTILINE | re.IGNORECASE,
-)
+# about how many bytes of a context are handed to docker at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def _read(path, size):
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        raise IOError('Can not read file in context: {}'.format(path))
+    with f:
+        while size > 0:
+            chunk = f.read(min(CHUNK_SIZE, size))
+            if not chunk:
+                raise IOError('{} changed while building the context'.format(
+                    path,
+                ))
+            size -= len(chunk)
+            yield chunk
+
+
+def _padding(size):
+    return tarfile.NUL * (-size % tarfile.BLOCKSIZE)
 
 
-def bundle_docker_dir(tag, docker_path):
+def _blob_id(path, size):
     """
-    Tars up a directory using the normal docker.util.tar method but
-    adds tag if it's not None.
+    Hashes the file at path the way `git hash-object` does without filters.
     """
+    digest = hashlib.sha1('blob {}\0'.format(size).encode('ascii'))
+    for chunk in _read(path, size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _tarinfos(root, paths, reproducible=False):
+    """
+    Yields (full path, tarinfo) for paths (relative to root). Reproducible
+    tarinfos leave out the owner and modification time of the files.
+    """
+    # only used for its tarinfos, which keep track of hard links
+    archive = tarfile.open(fileobj=io.BytesIO(), mode='w')
+    for path in paths:
+        full_path = join(root, path)
+        info = archive.gettarinfo(full_path, arcname=path)
+        if info is None:
+            # a socket, which docker-py leaves out as well
+            continue
+        if reproducible:
+            info.mtime = 0
+            info.uid = info.gid = 0
+            info.uname = info.gname = ''
+        yield full_path, info
+
+
+def _dockerfile_info(dockerfile_name, dockerfile_content, reproducible):
+    info = tarfile.TarInfo(dockerfile_name)
+    info.size = len(dockerfile_content)
+    info.mtime = 0 if reproducible else int(time.time())
+    return info
 
-    # tar up the directory minus the Dockerfile,
 
+def _members(root, paths, dockerfile_name, dockerfile_content,
+             reproducible=False):
+    """
+    Yields the bytes of the tar members for paths (relative to root) and,
+    unless dockerfile_content is None, of dockerfile_name with that
+    content, last.
+    """
+    for full_path, info in _tarinfos(root, paths, reproducible):
+        yield info.tobuf()
+        if info.isreg():
+            for chunk in _read(full_path, info.size):
+                yield chunk
+            yield _padding(info.size)
+
+    if dockerfile_content is not None:
+        info = _dockerfile_info(
+            dockerfile_name, dockerfile_content, reproducible,
+        )
+        yield info.tobuf()
+        yield dockerfile_content
+        yield _padding(info.size)
+
+
+def _digest(root, paths, dockerfile_name, dockerfile_content, blob_ids):
+    """
+    Digests the reproducible tar of a context from the headers of its
+    members and the blob ids of their contents, taken from the dict
+    blob_ids (full path -> blob id) for the files git already hashed.
+
+    Returns the hex digest and the size of the files' contents.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for full_path, info in _tarinfos(root, paths, reproducible=True):
+        digest.update(info.tobuf())
+        if info.isreg():
+            blob = blob_ids.get(full_path) or _blob_id(full_path, info.size)
+            digest.update(blob.encode('ascii'))
+            size += info.size
+
+    if dockerfile_content is not None:
+        info = _dockerfile_info(dockerfile_name, dockerfile_content, True)
+        digest.update(info.tobuf())
+        digest.update(dockerfile_content)
+        size += info.size
+    return digest.hexdigest(), size
+
+
+def _cacheable(root, paths, dockerfile_content, contexts):
+    """
+    Whether the context of paths (relative to root) is worth digesting for
+    contexts: git already hashed every regular file in it, so no file needs
+    to be read, and it is small enough for contexts to keep.
+    """
+    blob_ids = contexts.blob_ids()
+    size = 0 if dockerfile_content is None else len(dockerfile_content)
+    for path in paths:
+        full_path = join(root, path)
+        try:
+            st = os.lstat(full_path)
+        except OSError:
+            return False
+        if stat.S_ISREG(st.st_mode):
+            if full_path not in blob_ids:
+                return False
+            size += st.st_size
+            if size > contexts.max_bytes:
+                return False
+    return True
+
+
+def _chunked(members):
+    """
+    Joins the bytes of members in chunks of about CHUNK_SIZE and ends the
+    archive.
+    """
+    size = 0
+    chunk = []
+    chunk_size = 0
+    for data in members:
+        chunk.append(data)
+        chunk_size += len(data)
+        if chunk_size >= CHUNK_SIZE:
+            yield b''.join(chunk)
+            size += chunk_size
+            chunk = []
+            chunk_size = 0
+
+    size += chunk_size + 2 * tarfile.BLOCKSIZE
+    chunk.append(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+    chunk.append(tarfile.NUL * (-size % tarfile.RECORDSIZE))
+    yield b''.join(chunk)
+
+
+# root: the directory of the Dockerfile
+# paths: the paths in root that go in the context, but the tagged Dockerfile
+# dockerfile_name: the name of the Dockerfile in root
+# dockerfile_content: the tagged content of the Dockerfile, or None if no
+#                     tag applies to it and it is one of paths
+# left_out: the bytes of the regular files a minimal context leaves out
+ContextFiles = namedtuple(
+    'ContextFiles',
+    ['root', 'paths', 'dockerfile_name', 'dockerfile_content', 'left_out'],
+)
+
+
+def _left_out_bytes(root, paths):
+    size = 0
+    for path in paths:
+        try:
+            st = os.lstat(join(root, path))
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            size += st.st_size
+    return size
+
+
+def context_files(tags, docker_path, sources=None):
+    """
+    Lists the files in the directory of docker_path that are not matched by
+    its .dockerignore (see dockerignore.exclude_paths), tagging the
+    Dockerfile with the tags in the dict tags (image name -> tag).
+
+    With sources, the absolute paths or globs that the Dockerfile copies
+    from (see image.copy_paths), the context is minimal: it only keeps the
+    Dockerfile, its .dockerignore, the sources, whatever is below them and
+    the directories above them.
+    """
     path = os.path.dirname(docker_path)
     try:
         with open(join(path, '.dockerignore')) as f:
@@ -34,29 +210,46 @@ def bundle_docker_dir(tag, docker_path):
         ignore = []
 
     dockerfile_name = os.path.basename(docker_path)
+    paths = sorted(dockerignore.exclude_paths(path, ignore, dockerfile_name))
 
-    if tag is None:
-        return utils.tar(path, ignore, dockerfile=dockerfile_name)
+    left_out = 0
+    if sources is not None:
+        match = source_control.copy_paths_matcher(path, sources)
+        kept = [p for p in paths if match(p.replace(os.path.sep, '/'))]
+        kept_set = frozenset(kept)
+        dirs = set()
+        for p in kept:
+            parent = os.path.dirname(p)
+            while parent and parent not in dirs:
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+        left_out = _left_out_bytes(path, (
+            p for p in paths if p not in kept_set and p not in dirs
+        ))
+        paths = sorted(kept_set | (dirs & frozenset(paths)))
 
-    # docker-py 1.6+ won't ignore the dockerfile
-    # passing dockerfile='' works around the issuen
-    # and lets us add the modified file when we're done.
-    ignore.append(dockerfile_name)
-    fileobj = utils.tar(path, ignore, dockerfile='')
+    contents = None
+    if tags:
+        # the Dockerfile goes last, with its tagged content
+        paths.remove(dockerfile_name)
+        contents = dockerfile.tag_parent(dockerfile.load(docker_path), tags)
+        if not isinstance(contents, bytes):
+            contents = contents.encode('utf8')
+    return ContextFiles(path, paths, dockerfile_name, contents, left_out)
 
-    t = tarfile.open(fileobj=fileobj, mode='a')
-    dfinfo = tarfile.TarInfo(dockerfile_name)
 
-    contents = tag_parent(tag, open(join(path, dockerfile_name)).read())
-    if not isinstance(contents, bytes):
-        contents = contents.encode('utf8')
-    dockerfile = io.BytesIO(contents)
+def bundle_docker_dir(tags, docker_path):
+    """
+    Tars up the directory of docker_path, leaving out the paths its
+    .dockerignore matches the way docker.utils.tar does, but adds the tags
+    in the dict tags (image name -> tag) to the FROM lines of the
+    Dockerfile, if any.
 
-    dfinfo.size = len(dockerfile.getvalue())
-    t.addfile(dfinfo, dockerfile)
-    t.close()
-    fileobj.seek(0)
-    return fileobj
+    Returns an iterator of the chunks of the tar, which are read from disk
+    as they are needed.
+    """
+    files = context_files(tags, docker_path)
+    return _chunked(_members(*files[:4]))
 
 
 def tag_parent(tag, docker_content):
@@ -128,24 +321,53 @@ def tag_parent(tag, docker_content):
     <BLANKLINE>
     """
 
-    return RE_DOCKER_TAG.sub(
-        r'\g<from>\g<registry>\g<name>:{tag}\g<whitespace>'.format(tag=tag),
-        docker_content,
-    )
+    df = dockerfile.parse(docker_content)
+    tags = {image: tag for image, _ in df.from_spans}
+    return dockerfile.tag_parent(df, tags)
 
 
-# str -> str -> fileobj
-def mkcontext(tag, docker_path):
+# {str: str} -> str -> ContextCache -> [str] -> [bytes]
+def mkcontext(tags, docker_path, contexts=None, sources=None):
     """
-    Returns a streaming tarfile suitable for passing to docker build.
+    Returns the chunks of a tarfile suitable for passing to docker build,
+    see bundle_docker_dir, or with sources a minimal one, see
+    context_files.
 
     This method expects that there will be a Dockerfile in the same
-    directory as path. The contents of which will be substituted
-    with a tag that ensures that the image depends on a parent built
-    within the same build_ref (bulid group) as the image being built.
+    directory as path. The FROM lines naming an image in tags will be
+    substituted with its tag, which ensures that the image depends on the
+    parents built within the same build_ref (bulid group) as the image
+    being built.
+    """
+    return tar_context(context_files(tags, docker_path, sources), contexts)
+
+
+# ContextFiles -> ContextCache -> [bytes]
+def tar_context(files, contexts=None):
+    """
+    Returns the chunks of the tar of files, a ContextFiles.
+
+    With a ContextCache as contexts, the tar is reproducible, without the
+    owners and modification times of the files, whether it is cached or not,
+    and is known by a digest of its content. A context built before is
+    returned as the open file kept by contexts, and any other is kept in
+    contexts as it is read. contexts is left alone for a context with files
+    git has not hashed or too large for it to keep.
     """
+    root, paths, dockerfile_name, contents, _ = files
+    if contexts is None:
+        return _chunked(_members(root, paths, dockerfile_name, contents))
+    if not _cacheable(root, paths, contents, contexts):
+        return _chunked(_members(
+            root, paths, dockerfile_name, contents, reproducible=True,
+        ))
 
-    return bundle_docker_dir(
-        tag,
-        docker_path,
+    digest, size = _digest(
+        root, paths, dockerfile_name, contents, contexts.blob_ids(),
     )
+    cached = contexts.get(digest)
+    if cached is not None:
+        return cached
+    return contexts.put(digest, size, _chunked(_members(
+        root, paths, dockerfile_name, contents, reproducible=True,
+    )))
@@ -3,10 +3,11 @@ from __future__ import absolute_import
 import json
 import os
 
-from . import dependencies, source_control
+from . import source_control
+from .base import select_targets
 
 
-def targets(path='.', upto=None, tags=None, mode=None):
+def targets(path='.', upto=None, tags=None, mode=None, jobs=1):
     if upto is None:
         upto = []
     try:
@@ -21,17 +22,18 @@ def targets(path='.', upto=None, tags=None, mode=None):
     namespace = config['namespace']
     name_map = config.get('names', {})
 
-    scm = source_control.source_control(path, namespace, name_map, mode)
-    targets = dependencies.eval(
-        {
-            'upto': upto,
-            'exact': [],
-            'dependents': [],
-            'exclude': [],
-        },
-        scm.targets(),
+    scm = source_control.source_control(
+        path, namespace, name_map, mode, ref_mode=config.get('ref_mode'),
+        jobs=jobs,
     )
-    this_ref_str = scm.this_ref_str()
+    dirty_state = scm.dirty_state()
+    targets = select_targets(scm, {
+        'upto': upto,
+        'exact': [],
+        'dependents': [],
+        'exclude': [],
+    }, dirty_state)
+    this_ref_str = scm.this_ref_str(dirty_state)
     default_tags = scm.default_tags()
     all_tags = (
         (tags if tags is not None else []) +
@@ -4,6 +4,23 @@ import docker
 import pytest
 from docker import utils as docker_utils
 
+from shipwright._lib import image, source_control
+
+
+def target(name, *parents):
+    """
+    A Target for an image named name, built from parents (ubuntu by
+    default), with the ref abc.
+    """
+    parents = parents or ('ubuntu',)
+    return source_control.Target(
+        image.Image(
+            name, name, name + '/Dockerfile', parents[0], name,
+            frozenset(), parents,
+        ),
+        'abc', None,
+    )
+
 
 @pytest.fixture(scope='session')
 def docker_client():
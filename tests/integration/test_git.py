@@ -1,9 +1,12 @@
 from __future__ import absolute_import
 
+import os
+
+import git
 import pkg_resources
 import pytest
 
-from shipwright._lib import source_control
+from shipwright._lib import compat, dockerfile, image, source_control, tar
 
 from .utils import commit_untracked, create_repo
 
@@ -226,3 +229,411 @@ def test_dirty_tags_various(func, tmpdir):
     }
     assert old_ref_str == tag
     assert new_ref_str == dirty_tag
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_last_commits_matches_rev_list(tmpdir, monkeypatch, jobs):
+    monkeypatch.setattr(source_control, '_HISTORY_CHUNK', 2)
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    config = repo.config_writer()
+    config.set_value('user', 'name', 'shipwright')
+    config.set_value('user', 'email', 'shipwright@example.com')
+    config.release()
+    master = repo.head.ref
+
+    feature = repo.create_head('feature')
+    feature.checkout()
+    tmp.join('service1/a.txt').write('feature')
+    commit_untracked(repo)
+
+    master.checkout()
+    tmp.join('shared/a.txt').write('master')
+    commit_untracked(repo)
+    repo.git.merge('feature', no_ff=True, no_edit=True)
+
+    ours = repo.create_head('ours')
+    ours.checkout()
+    tmp.join('base/a.txt').write('discarded')
+    commit_untracked(repo)
+    master.checkout()
+    repo.git.merge('ours', strategy='ours', no_edit=True)
+
+    specs = [
+        ('base',),
+        ('base/Dockerfile', 'shared/a.txt'),
+        ('service1', 'shared/*.txt'),
+        ('does-not-exist',),
+    ]
+    expected = []
+    for paths in specs:
+        commits = repo.iter_commits(paths=paths, max_count=1, topo_order=True)
+        expected.append(next((c.hexsha for c in commits), None))
+
+    assert expected[-1] is None
+    assert source_control._last_commits(repo, specs, jobs) == expected
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_last_commits_non_utf8_paths(tmpdir, jobs):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    name = compat.fsdecode(b'base/caf\xe9.txt')
+    with open(os.path.join(path, name), 'w') as f:
+        f.write('latin-1')
+    repo.git.add('--all')
+    repo.git.commit(
+        '-m', 'Non UTF-8 file name',
+        author='shipwright <shipwright@example.com>',
+        env={
+            'GIT_COMMITTER_NAME': 'shipwright',
+            'GIT_COMMITTER_EMAIL': 'shipwright@example.com',
+        },
+    )
+
+    commits = list(source_control._history(repo, ['HEAD'], jobs))
+    assert commits[0][3] == [frozenset([name])]
+    assert source_control._last_commits(repo, [('base',)], jobs) == [
+        repo.head.commit.hexsha,
+    ]
+
+
+def test_refs_cached_per_head(tmpdir, monkeypatch):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    tag = repo.head.ref.commit.hexsha[:12]
+
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    refs = _refs(scm.targets())
+    assert tmp.join('.git/shipwright/refs').listdir()
+
+    def no_walk(repo, specs):
+        raise AssertionError('history walked on a cached HEAD')
+
+    monkeypatch.setattr(source_control, '_last_commits', no_walk)
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    assert _refs(scm.targets()) == refs
+    assert set(refs.values()) == {tag}
+
+
+def test_refs_cached_per_shallow_state(tmpdir):
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    origin = tmpdir.join('origin')
+    repo = create_repo(str(origin), source)
+    base_tag = repo.head.ref.commit.hexsha[:12]
+    origin.join('shared/a.txt').write('shared')
+    commit_untracked(repo)
+
+    path = str(tmpdir.join('clone'))
+    git.Repo.clone_from(
+        'file://' + str(origin), path, depth=1, no_single_branch=True,
+    )
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    # the history before the shallow commit is missing
+    shallow_refs = _refs(scm.targets())
+    assert shallow_refs['shipwright/base'] != base_tag
+
+    git.Repo(path).git.fetch('--unshallow')
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    assert _refs(scm.targets())['shipwright/base'] == base_tag
+
+
+def test_refs_computed_incrementally(tmpdir, monkeypatch):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    old_tag = repo.head.ref.commit.hexsha[:12]
+
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    scm.targets()
+
+    original = tmp.join('base/base.txt').read()
+    tmp.join('shared/base.txt').write('Hi mum')
+    commit_untracked(repo)
+    for content in ['Hi again', original]:  # change and revert
+        tmp.join('base/base.txt').write(content)
+        repo.index.add(['base/base.txt'])
+        repo.index.commit(content)
+    new_tag = repo.head.ref.commit.hexsha[:12]
+
+    def no_full_walk(repo, specs):
+        raise AssertionError('full history walk')
+
+    monkeypatch.setattr(source_control, '_last_commits', no_full_walk)
+    assert _refs(scm.targets()) == {
+        'shipwright/base': new_tag,
+        'shipwright/shared': new_tag,
+        'shipwright/service1': new_tag,
+    }
+    monkeypatch.undo()
+
+    tmp.join('shared/base.txt').write('Hi again')
+    repo.index.add(['shared/base.txt'])
+    repo.index.commit('shared')
+    specs = [('base',), ('base', 'shared')]
+    since = source_control._last_commits_since(
+        repo, specs, repo.head.commit.parents[0].hexsha,
+        {('base',): 'x' * 40},
+    )
+    assert since == ['x' * 40, repo.head.commit.hexsha]
+
+    unrelated = source_control._last_commits_since(
+        repo, specs, 'f' * 40, {('base',): 'x' * 40},
+    )
+    assert unrelated == source_control._last_commits(repo, specs)
+    assert unrelated[0][:12] == new_tag != old_tag
+
+
+def test_dirty_hashes_reused_across_runs(tmpdir, monkeypatch):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    tag = repo.head.ref.commit.hexsha[:12]
+
+    tmp.join('shared/base.txt').write('Hi mum')  # Untracked
+    os.utime(str(tmp.join('shared/base.txt')), (1000000000, 1000000000))
+
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    refs = _refs(scm.targets())
+
+    hashed = []
+    hash_objects = source_control._hash_objects
+
+    def spy(repo, paths):
+        hashed.extend(paths)
+        return hash_objects(repo, paths)
+
+    monkeypatch.setattr(source_control, '_hash_objects', spy)
+    assert _refs(scm.targets()) == refs
+    assert hashed == []
+    assert refs['shipwright/shared'] == tag + '-dirty-adc37b7d003f'
+
+
+def test_tree_refs(tmpdir):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+        ref_mode=source_control.TREE_REFS,
+    )
+    old_refs = _refs(scm.targets())
+    assert len(set(old_refs.values())) == 3
+
+    original = tmp.join('shared/Dockerfile').read()
+    tmp.join('shared/Dockerfile').write(original + '\n')
+    repo.index.add(['shared/Dockerfile'])
+    repo.index.commit('Change shared')
+    tmp.join('unrelated.txt').write('Hi mum')
+    commit_untracked(repo)
+
+    new_refs = _refs(scm.targets())
+    assert new_refs['shipwright/base'] == old_refs['shipwright/base']
+    assert new_refs['shipwright/shared'] != old_refs['shipwright/shared']
+    assert new_refs['shipwright/service1'] != old_refs['shipwright/service1']
+
+    tmp.join('shared/Dockerfile').write(original)
+    repo.index.add(['shared/Dockerfile'])
+    repo.index.commit('Revert shared')
+    assert _refs(scm.targets()) == old_refs
+
+    tmp.join('shared/base.txt').write('Hi mum')  # Untracked
+    dirty_refs = _refs(scm.targets())
+    assert dirty_refs['shipwright/base'] == old_refs['shipwright/base']
+    assert dirty_refs['shipwright/shared'] == (
+        old_refs['shipwright/shared'] + '-dirty-adc37b7d003f'
+    )
+
+
+def test_unknown_ref_mode(tmpdir):
+    path = str(tmpdir.join('shipwright-sample'))
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    create_repo(path, source)
+    with pytest.raises(ValueError):
+        source_control.GitSourceControl(
+            path=path,
+            namespace='shipwright',
+            name_map={},
+            ref_mode='mtime',
+        )
+
+
+def test_images_ignores_gitignored_dockerfiles(tmpdir):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    tmp.join('.gitignore').write('vendor/\n')
+    commit_untracked(repo)
+
+    vendor = tmp.mkdir('vendor').mkdir('thing')
+    vendor.join('Dockerfile').write('FROM ubuntu\n')
+    new = tmp.mkdir('service2')
+    new.join('Dockerfile').write('FROM shipwright/base\n')  # Untracked
+
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    names = sorted(i.name for i in scm.images())
+    assert names == [
+        'shipwright/base',
+        'shipwright/service1',
+        'shipwright/service2',
+        'shipwright/shared',
+    ]
+
+
+def test_images_parsed_concurrently_in_order(tmpdir):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    create_repo(path, source)
+
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+    assert scm.discovery_time is None
+    images = scm.images()
+    assert scm.discovery_time >= 0
+
+    dockerfiles = [p for p, _ in source_control._dockerfiles(scm._repo, path)]
+    assert [i.path for i in images] == dockerfiles
+    serial = image.list_images('shipwright', {}, path, dockerfiles, threads=1)
+    assert images == serial
+
+
+def test_images_loaded_from_index(tmpdir, monkeypatch):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    create_repo(path, source)
+
+    def scm():
+        return source_control.GitSourceControl(
+            path=path,
+            namespace='shipwright',
+            name_map={},
+        )
+
+    images = scm().images()
+
+    parsed = []
+    load = dockerfile.load
+
+    def spy(docker_path):
+        parsed.append(docker_path)
+        return load(docker_path)
+
+    monkeypatch.setattr(dockerfile, 'load', spy)
+    assert scm().images() == images
+    assert parsed == []
+
+    service1 = tmp.join('service1/Dockerfile')
+    service1.write('FROM shipwright/base\nCOPY new.txt /code/\n')
+    os.utime(str(service1), (1000000000, 1000000000))
+    new_images = {i.name: i for i in scm().images()}
+    assert parsed == [str(service1)]
+    assert new_images['shipwright/service1'].parent == 'shipwright/base'
+    assert str(tmp.join('service1/new.txt')) in (
+        new_images['shipwright/service1'].copy_paths
+    )
+
+
+def test_blob_ids(tmpdir):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    scm = source_control.GitSourceControl(
+        path=path,
+        namespace='shipwright',
+        name_map={},
+    )
+
+    blob_ids = scm.blob_ids()
+    base = str(tmp.join('base/Dockerfile'))
+    assert blob_ids[base] == repo.head.commit.tree['base/Dockerfile'].hexsha
+    assert blob_ids[base] == tar._blob_id(base, os.path.getsize(base))
+
+    tmp.join('base/Dockerfile').write('FROM debian\n')
+    tmp.join('base/new.txt').write('Hi mum')
+    blob_ids = scm.blob_ids()
+    assert base not in blob_ids
+    assert str(tmp.join('base/new.txt')) not in blob_ids
+    assert str(tmp.join('shared/Dockerfile')) in blob_ids
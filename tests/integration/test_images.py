@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 import argparse
+import json
 
 import pkg_resources
 from docker import utils as docker_utils
@@ -40,3 +41,38 @@ def test_sample(tmpdir, capsys):
     expected = {tmpl.format(img=i, tag=tag) for i in images}
 
     assert {l for l in out.split('\n') if l} == expected
+
+
+def test_graph(tmpdir, capsys):
+    path = str(tmpdir.join('shipwright-sample'))
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    repo = create_repo(path, source)
+    tag = repo.head.ref.commit.hexsha[:12]
+
+    client_cfg = docker_utils.kwargs_from_env()
+    args = get_defaults()
+    args['images'] = True
+    args['--graph'] = True
+
+    shipw_cli.run(
+        path=path,
+        client_cfg=client_cfg,
+        arguments=args,
+        environ={},
+    )
+
+    out, err = capsys.readouterr()
+    assert json.loads(out) == {
+        'levels': [
+            ['shipwright/base:' + tag],
+            ['shipwright/shared:' + tag],
+            ['shipwright/service1:' + tag],
+        ],
+        'edges': [
+            ['shipwright/base', 'shipwright/shared'],
+            ['shipwright/shared', 'shipwright/service1'],
+        ],
+    }
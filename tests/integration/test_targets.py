@@ -4,6 +4,7 @@ import pkg_resources
 import pytest
 
 from shipwright import exceptions, targets
+from shipwright._lib import source_control
 
 from . import utils
 
@@ -81,3 +82,48 @@ def test_no_repo(tmpdir):
     tmp.join('.git').remove(rec=1)
     with pytest.raises(exceptions.SourceControlNotFound):
         targets.targets(path=path)
+
+
+def test_refs_only_computed_for_selection(tmpdir, monkeypatch):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    utils.create_repo(path, source)
+
+    resolved = []
+    targets_ = source_control.GitSourceControl.targets
+
+    def spy(self, images=None, names=None, dirty_state=None):
+        result = targets_(self, images, names, dirty_state)
+        resolved.extend(t.name for t in result)
+        return result
+
+    monkeypatch.setattr(source_control.GitSourceControl, 'targets', spy)
+    targets.targets(path=path, upto=['shared'])
+    assert sorted(resolved) == ['shipwright/base', 'shipwright/shared']
+
+
+def test_one_dirty_snapshot_per_run(tmpdir, monkeypatch):
+    tmp = tmpdir.join('shipwright-sample')
+    path = str(tmp)
+    source = pkg_resources.resource_filename(
+        __name__,
+        'examples/shipwright-sample',
+    )
+    utils.create_repo(path, source)
+    tmp.join('shared/a.txt').write('dirty')
+
+    snapshots = []
+    dirty_state = source_control._dirty_state
+
+    def spy(repo, cache=None):
+        snapshots.append(repo)
+        return dirty_state(repo, cache)
+
+    monkeypatch.setattr(source_control, '_dirty_state', spy)
+    result = targets.targets(path=path, upto=['shared'])
+    assert len(snapshots) == 1
+    assert any('-dirty-' in t for t in result)
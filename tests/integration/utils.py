@@ -46,4 +46,5 @@ def default_args():
         dirty=False,
         pull_cache=False,
         registry_login=[],
+        jobs=1,
     )
@@ -0,0 +1,195 @@
+from __future__ import absolute_import
+
+import threading
+import time
+
+import pytest
+
+from conftest import target
+from shipwright._lib import build, build_history
+from shipwright._lib.msg import BuildComplete
+
+targets = [
+    target('base'),
+    target('independent'),
+    target('shared', 'base'),
+    target('service1', 'shared'),
+    target('service2', 'shared'),
+    target('service3', 'ubuntu', 'service1', 'independent'),
+]
+
+
+@pytest.fixture
+def fake_build(monkeypatch):
+    log = []
+    lock = threading.Lock()
+    running = [0]
+
+    def fake(client, parent_refs, target, cache):
+        with lock:
+            running[0] += 1
+            log.append(('start', target.name, running[0]))
+        yield {'event': 'build_msg', 'target': target, 'parents': parent_refs}
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+            log.append(('end', target.name))
+
+    monkeypatch.setattr(build, 'build', fake)
+    return log
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 8])
+def test_parents_complete_before_children_start(fake_build, jobs):
+    events = list(build.do_build(None, 'abc', targets, None, jobs=jobs))
+
+    completed = [e.target.name for e in events if isinstance(e, BuildComplete)]
+    assert sorted(completed) == sorted(t.name for t in targets)
+
+    for t in targets:
+        start = fake_build.index(next(
+            e for e in fake_build if e[:2] == ('start', t.name)
+        ))
+        for p in t.parents:
+            if p != 'ubuntu':
+                assert fake_build.index(('end', p)) < start
+
+    concurrency = max(e[2] for e in fake_build if e[0] == 'start')
+    if jobs == 1:
+        assert concurrency == 1
+    else:
+        assert 1 < concurrency <= jobs
+
+    build_msgs = {
+        e['target'].name: e['parents'] for e in events
+        if not isinstance(e, BuildComplete)
+    }
+    assert build_msgs['service3'] == {'service1': 'abc', 'independent': 'abc'}
+
+
+def test_failure_is_raised(monkeypatch):
+    def failing(client, parent_refs, target, cache):
+        raise ValueError(target.name)
+        yield
+
+    monkeypatch.setattr(build, 'build', failing)
+    with pytest.raises(ValueError):
+        list(build.do_build(None, 'abc', targets, None, jobs=2))
+
+
+def test_durations_are_recorded_and_prioritise(fake_build, tmpdir):
+    history = build_history.BuildHistory(str(tmpdir.join('durations.json')))
+    history.record('a', 1.0)
+    history.record('b', 1.0)
+    history.record('c', 10.0)
+    roots = [target('a'), target('b'), target('c')]
+
+    list(build.do_build(None, 'abc', roots, None, jobs=2, history=history))
+
+    first_two = [e[1] for e in fake_build if e[0] == 'start'][:2]
+    assert 'c' in first_two
+
+    durations = build_history.BuildHistory(history.path).durations()
+    assert sorted(durations) == ['a', 'b', 'c']
+    assert all(0 < seconds < 10 for seconds in durations.values())
+
+
+@pytest.fixture
+def failing_shared(monkeypatch):
+    built = []
+
+    def fake(client, parent_refs, target, cache):
+        built.append(target.name)
+        if target.name == 'shared':
+            yield {'error': 'no', 'errorDetail': {'message': 'no'}}
+        else:
+            yield {'event': 'build_msg', 'target': target}
+
+    monkeypatch.setattr(build, 'build', fake)
+    return built
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 8])
+def test_dependents_of_a_failure_are_skipped(failing_shared, jobs):
+    events = list(build.do_build(None, 'abc', targets, None, jobs=jobs))
+
+    assert sorted(failing_shared) == ['base', 'independent', 'shared']
+    skipped = [
+        e for e in events
+        if isinstance(e, dict) and e.get('event') == 'skipped'
+    ]
+    assert sorted(e['target'].name for e in skipped) == [
+        'service1', 'service2', 'service3',
+    ]
+    assert {e['failed'] for e in skipped} == {'shared'}
+
+    completed = [e.target.name for e in events if isinstance(e, BuildComplete)]
+    assert sorted(completed) == ['base', 'independent', 'shared']
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_fail_fast(failing_shared, jobs):
+    events = list(build.do_build(
+        None, 'abc', targets, None, jobs=jobs, fail_fast=True,
+    ))
+
+    assert 'error' in events[-1]
+    assert not [
+        e for e in events
+        if isinstance(e, dict) and e.get('event') == 'skipped'
+    ]
+    assert 'service1' not in failing_shared
+
+
+def test_later_ready_targets_start_by_priority(monkeypatch, tmpdir):
+    seconds = {'r1': 3, 'r2': 3, 'r3': 3, 'l': 1, 'l2': 10}
+    starts = []
+    l2_started = threading.Event()
+    # every worker thread has its own clock, which only the builds move
+    clock = threading.local()
+    monkeypatch.setattr(build.time, 'time', lambda: getattr(clock, 'now', 0))
+
+    def fake(client, parent_refs, target, cache):
+        starts.append(target.name)
+        if target.name == 'l2':
+            l2_started.set()
+        elif target.name == 'r1':
+            # still running when l completes and frees a worker
+            assert l2_started.wait(5)
+        clock.now = getattr(clock, 'now', 0) + seconds[target.name]
+        yield {'event': 'build_msg', 'target': target}
+
+    monkeypatch.setattr(build, 'build', fake)
+    history = build_history.BuildHistory(str(tmpdir.join('durations.json')))
+    for name, s in seconds.items():
+        history.record(name, s)
+    chain = [
+        target('r1'), target('r2'), target('r3'), target('l'),
+        target('l2', 'l'),
+    ]
+
+    list(build.do_build(None, 'abc', chain, None, jobs=2, history=history))
+
+    assert sorted(starts[:2]) == ['l', 'r1']
+    assert starts[2] == 'l2'
+
+    durations = build_history.BuildHistory(history.path).durations()
+    assert durations == seconds
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('fail_fast', [False, True])
+def test_failures_are_not_recorded(monkeypatch, tmpdir, jobs, fail_fast):
+    def fake(client, parent_refs, target, cache):
+        yield {'stream': 'building'}
+        yield {'error': 'no', 'errorDetail': {'message': 'no'}}
+
+    monkeypatch.setattr(build, 'build', fake)
+    history = build_history.BuildHistory(str(tmpdir.join('durations.json')))
+
+    list(build.do_build(
+        None, 'abc', [target('a')], None, jobs=jobs, history=history,
+        fail_fast=fail_fast,
+    ))
+
+    assert history.durations() == {}
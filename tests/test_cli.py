@@ -88,6 +88,7 @@ def test_args():
         '--dump-file': None,
         '--exact': [],
         '--exclude': [],
+        '--graph': False,
         '--help': False,
         '--no-build': False,
         '--upto': [],
@@ -116,6 +117,7 @@ def test_args_2():
         '--dump-file': None,
         '--exact': [],
         '--exclude': [],
+        '--graph': False,
         '--help': False,
         '--no-build': False,
         '--upto': [],
@@ -140,6 +142,7 @@ def test_args_base():
         '--dump-file': None,
         '--exact': [],
         '--exclude': [],
+        '--graph': False,
         '--help': False,
         '--no-build': False,
         '--upto': [],
@@ -151,3 +154,16 @@ def test_args_base():
         'images': False,
         'tags': ['latest'],
     }
+
+
+def test_args_jobs():
+    parser = cli.argparser()
+    assert parser.parse_args(['images']).jobs == 1
+    assert parser.parse_args(['images', '-j', '8']).jobs == 8
+
+
+def test_args_graph():
+    parser = cli.argparser()
+    assert not cli.old_style_arg_dict(parser.parse_args(['images']))['--graph']
+    args = cli.old_style_arg_dict(parser.parse_args(['images', '--graph']))
+    assert args['--graph']
@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+
+import os
+
+from shipwright._lib import context_cache
+
+
+def test_put_and_get(tmpdir):
+    contexts = context_cache.ContextCache(str(tmpdir.join('contexts')))
+    assert contexts.get('abc') is None
+
+    assert list(contexts.put('abc', 3, iter([b'a', b'bc']))) == [b'a', b'bc']
+    with contexts.get('abc') as f:
+        assert f.read() == b'abc'
+
+
+def test_unfinished_contexts_are_not_kept(tmpdir):
+    contexts = context_cache.ContextCache(str(tmpdir))
+    chunks = contexts.put('abc', 3, iter([b'a', b'bc']))
+    assert next(chunks) == b'a'
+    chunks.close()
+
+    assert contexts.get('abc') is None
+    assert tmpdir.listdir() == []
+
+
+def test_least_recently_used_are_evicted(tmpdir):
+    contexts = context_cache.ContextCache(str(tmpdir), max_bytes=35)
+    for i, digest in enumerate(['a', 'b', 'c']):
+        list(contexts.put(digest, 10, iter([b'x' * 10])))
+        os.utime(str(tmpdir.join(digest + '.tar')), (i, i))
+    contexts.get('a').close()
+
+    list(contexts.put('d', 10, iter([b'x' * 10])))
+
+    assert sorted(p.basename for p in tmpdir.listdir()) == [
+        'a.tar', 'c.tar', 'd.tar',
+    ]
+
+
+def test_large_contexts_are_not_kept(tmpdir):
+    contexts = context_cache.ContextCache(str(tmpdir), max_bytes=5)
+    assert list(contexts.put('abc', 10, iter([b'x' * 10]))) == [b'x' * 10]
+    assert contexts.get('abc') is None
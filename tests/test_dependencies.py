@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import time
+
 from shipwright._lib import dependencies, image, source_control
 
 
@@ -7,13 +9,16 @@ def names_list(targets):
     return sorted(n.name for n in targets)
 
 
-def _names(tree):
-    return [n.name for n in dependencies._brood(tree)]
+def _names(targets):
+    return [n.name for n in targets]
 
 
-def target(name, dir_path, path, parent):
+def target(name, dir_path, path, parent, *other_parents):
     return source_control.Target(
-        image.Image(name, dir_path, path, parent, name, frozenset([path])),
+        image.Image(
+            name, dir_path, path, parent, name, frozenset([path]),
+            (parent,) + other_parents,
+        ),
         'abc', None,
     )
 
@@ -88,24 +93,148 @@ def test_breadth_first_iter():
     ]
 
 
-def test_make_tree():
-    root = dependencies._make_tree(targets)
-    assert root.node().name is None
+def test_make_graph():
+    graph = dependencies._make_graph(targets)
+
+    assert _names(dependencies._brood(graph)) == [
+        'shipwright_test/1',
+        'shipwright_test/independent',
+        'shipwright_test/2',
+        'shipwright_test/3',
+    ]
+
+    assert _names(graph.roots) == [
+        'shipwright_test/1', 'shipwright_test/independent',
+    ]
+    assert _names(graph.children['shipwright_test/1']) == [
+        'shipwright_test/2',
+    ]
+    assert _names(graph.children['shipwright_test/2']) == [
+        'shipwright_test/3',
+    ]
+    assert graph.children['shipwright_test/3'] == []
+
+    assert graph.find('shipwright_test/2').name == 'shipwright_test/2'
+    assert graph.find('independent') is None
+
+
+multi_stage_targets = targets + [
+    target(
+        'shipwright_test/4', 'path4/', 'path4/Dockerfile',
+        'shipwright_test/independent', 'shipwright_test/2',
+    ),
+    target(
+        'shipwright_test/5', 'path5/', 'path5/Dockerfile',
+        'shipwright_test/4',
+    ),
+]
+
+
+def test_upto_multi_stage():
+    bt = default_build_targets()
+    bt['upto'] = ['shipwright_test/4']
+    result = names_list(dependencies.eval(bt, multi_stage_targets))
+    assert result == [
+        'shipwright_test/1', 'shipwright_test/2', 'shipwright_test/4',
+        'shipwright_test/independent',
+    ]
+
+
+def test_dependents_multi_stage():
+    bt = default_build_targets()
+    bt['dependents'] = ['shipwright_test/2']
+    result = names_list(dependencies.eval(bt, multi_stage_targets))
+    assert result == [
+        'shipwright_test/1', 'shipwright_test/2', 'shipwright_test/3',
+        'shipwright_test/4', 'shipwright_test/5',
+    ]
+
+    # every parent of the target, like upto, not only its primary lineage
+    bt['dependents'] = ['shipwright_test/4']
+    result = names_list(dependencies.eval(bt, multi_stage_targets))
+    assert result == [
+        'shipwright_test/1', 'shipwright_test/2', 'shipwright_test/4',
+        'shipwright_test/5', 'shipwright_test/independent',
+    ]
+
+
+def test_exclude_multi_stage():
+    bt = default_build_targets()
+    bt['exclude'] = ['shipwright_test/2']
+    result = names_list(dependencies.eval(bt, multi_stage_targets))
+    assert result == ['shipwright_test/1', 'shipwright_test/independent']
+
 
-    assert _names(root) == [
+def test_parents_built_first_multi_stage():
+    bt = default_build_targets()
+    deep_parent = target(
+        'shipwright_test/6', 'path6/', 'path6/Dockerfile',
+        'shipwright_test/independent', 'shipwright_test/3',
+    )
+    results = dependencies.eval(bt, multi_stage_targets + [deep_parent])
+    assert [result.name for result in results] == [
         'shipwright_test/1',
         'shipwright_test/independent',
         'shipwright_test/2',
+        'shipwright_test/4',
         'shipwright_test/3',
+        'shipwright_test/5',
+        'shipwright_test/6',
+    ]
+
+
+# the most seconds one eval of the 10k image graph may take. It takes about
+# 0.1s, where the zipper tree it replaced did not finish within minutes.
+LARGE_GRAPH_SECONDS = 5
+
+
+def test_eval_large_graph():
+    # a synthetic 10k image graph, each image built from an earlier one
+    count = 10000
+    names = ['shipwright_test/{:05d}'.format(i) for i in range(count)]
+    large = [target(names[0], 'path/', 'path/Dockerfile', 'ubuntu')] + [
+        target(name, 'path/', 'path/Dockerfile', names[i // 2])
+        for i, name in enumerate(names) if i
     ]
 
-    sr_test_1 = root.down().node()
-    assert sr_test_1.image.name == 'shipwright_test/1'
+    start = time.time()
+    results = dependencies.eval(default_build_targets(), large[::-1])
+    assert time.time() - start < LARGE_GRAPH_SECONDS
+    assert len(results) == count
+    position = {t.name: i for i, t in enumerate(results)}
+    assert all(position[t.parent] < position[t.name] for t in large[1:])
 
-    assert _names(root.down()) == ['shipwright_test/2', 'shipwright_test/3']
+    bt = default_build_targets()
+    bt['upto'] = [names[-1]]
+    bt['exclude'] = [names[3]]
+    start = time.time()
+    results = dependencies.eval(bt, large)
+    assert time.time() - start < LARGE_GRAPH_SECONDS
+    assert [t.name for t in results] == [
+        names[i] for i in [
+            0, 1, 2, 4, 9, 19, 39, 78, 156, 312, 624, 1249, 2499, 4999, 9999,
+        ]
+    ]
 
-    sr_test_2 = root.down().down().node()
-    assert sr_test_2.image.name == 'shipwright_test/2'
 
-    assert _names(root.down().down()) == ['shipwright_test/3']
-    assert root.down().right().node().name == 'shipwright_test/independent'
+def test_levels():
+    results = dependencies.eval(default_build_targets(), multi_stage_targets)
+    levels = [_names(level) for level in dependencies.levels(results)]
+    assert levels == [
+        ['shipwright_test/1', 'shipwright_test/independent'],
+        ['shipwright_test/2'],
+        ['shipwright_test/4', 'shipwright_test/3'],
+        ['shipwright_test/5'],
+    ]
+
+
+def test_edges():
+    bt = default_build_targets()
+    bt['upto'] = ['shipwright_test/4']
+    results = dependencies.eval(bt, multi_stage_targets)
+    edges = [(p.name, c.name) for p, c in dependencies.edges(results)]
+    assert sorted(edges) == [
+        ('shipwright_test/1', 'shipwright_test/2'),
+        ('shipwright_test/2', 'shipwright_test/4'),
+        ('shipwright_test/independent', 'shipwright_test/4'),
+    ]
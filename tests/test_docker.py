@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+
+from conftest import target
+from shipwright._lib import build, cache, docker, image, source_control
+from shipwright._lib.msg import BuildComplete
+
+
+class FakeClient(object):
+    def __init__(self, images):
+        self._images = images
+        self.calls = []
+
+    def images(self, name=None):
+        self.calls.append(('images', name))
+        return self._images
+
+    def tag(self, image, repository, tag=None, force=False):
+        self.calls.append(('tag', image, repository, tag))
+
+    def build(self, fileobj, tag, **kwargs):
+        self.calls.append(('build', tag, b''.join(fileobj)))
+        return ['{"stream": "built"}']
+
+
+def test_inventory():
+    client = FakeClient([
+        {'Id': 'sha256:1', 'RepoTags': ['shipwright/base:abc', 'ubuntu:16']},
+        {'Id': 'sha256:2', 'RepoTags': ['localhost:5000/shipwright/x:abc']},
+        {'Id': 'sha256:3', 'RepoTags': None},
+    ])
+    inventory = docker.ImageInventory(client)
+    assert client.calls == []
+
+    assert ('shipwright/base', 'abc') in inventory
+    assert inventory.get('localhost:5000/shipwright/x', 'abc') == 'sha256:2'
+    assert ('shipwright/base', 'def') not in inventory
+
+    inventory.add('shipwright/base', 'def')
+    assert ('shipwright/base', 'def') in inventory
+    assert client.calls == [('images', None)]
+
+
+def test_noop_build_lists_images_once():
+    targets = [target('shipwright/image{}'.format(i)) for i in range(300)]
+    client = FakeClient([
+        {'Id': 'sha256:{}'.format(i), 'RepoTags': [t.name + ':abc']}
+        for i, t in enumerate(targets)
+    ])
+    the_cache = cache.NoCache(client)
+
+    events = list(build.do_build(client, 'abc', targets, the_cache))
+
+    assert [e.target for e in events] == targets
+    assert all(isinstance(e, BuildComplete) for e in events)
+    assert client.calls == [('images', None)]
+
+
+def test_tag_skips_existing_tags():
+    client = FakeClient([
+        {'Id': 'sha256:1', 'RepoTags': ['shipwright/base:abc']},
+        {'Id': 'sha256:2', 'RepoTags': ['shipwright/base:old']},
+    ])
+    the_cache = cache.NoCache(client)
+    base = target('shipwright/base')
+
+    list(the_cache.tag([base], ['old', 'new']))
+    list(the_cache.tag([base], ['old', 'new']))
+
+    assert client.calls == [
+        ('images', None),
+        ('tag', 'shipwright/base:abc', 'shipwright/base', 'old'),
+        ('tag', 'shipwright/base:abc', 'shipwright/base', 'new'),
+    ]
+
+
+def test_minimal_context_report(tmpdir):
+    docker_path = tmpdir.join('Dockerfile')
+    docker_path.write('FROM ubuntu\nCOPY app /app/\n')
+    tmpdir.join('app').write('app')
+    tmpdir.join('fixture').write('x' * 100)
+    t = source_control.Target(
+        image.Image(
+            'shipwright/app', str(tmpdir), str(docker_path), 'ubuntu', 'app',
+            image.copy_paths(str(docker_path)), ('ubuntu',),
+        ),
+        'abc', None,
+    )
+    client = FakeClient([])
+    the_cache = cache.NoCache(
+        client, minimal_context=lambda image: image.short_name == 'app',
+    )
+
+    events = list(the_cache.build({}, t))
+
+    assert events[0]['context_bytes_saved'] == 100
+    assert events[1:] == [{'stream': 'built'}]
+    assert ('shipwright/app', 'abc') in the_cache.inventory
@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+
+import os
+
+from shipwright._lib import dockerfile
+
+
+def test_load_reuses_parse_until_file_changes(tmpdir):
+    path = tmpdir.join('Dockerfile')
+    path.write('FROM base\nCOPY a /code/\n')
+
+    first = dockerfile.load(str(path))
+    assert first.parent == 'base'
+    assert first.copy_sources == ('a',)
+    assert dockerfile.load(str(path)) is first
+
+    path.write('FROM other\nCOPY a b /code/\n')
+    st = os.stat(str(path))
+    os.utime(str(path), (st.st_atime, st.st_mtime + 10))
+
+    second = dockerfile.load(str(path))
+    assert second.parent == 'other'
+    assert second.copy_sources == ('a', 'b')
+
+
+def test_tag_parent_rewrites_from_spans():
+    df = dockerfile.parse(
+        'FROM base\n'
+        'FROM localhost:5000/r/image  \n'
+        'FROM tagged:1\n',
+    )
+    tags = {'base': 'xyz', 'localhost:5000/r/image': 'abc'}
+    assert dockerfile.tag_parent(df, tags) == (
+        'FROM base:xyz\n'
+        'FROM localhost:5000/r/image:abc  \n'
+        'FROM tagged:1\n'
+    )
+
+
+def test_tag_parent_multi_stage():
+    df = dockerfile.parse(
+        'FROM ubuntu AS build\n'
+        'FROM shipwright/base AS runtime\n'
+        'COPY --from=shipwright/tools /bin/tool /bin/\n'
+        'FROM build\n'
+        'FROM --platform=linux/amd64 shipwright/base\n',
+    )
+    assert df.parents == ('ubuntu', 'shipwright/base', 'shipwright/tools')
+    assert df.copy_sources == ()
+
+    tags = {'shipwright/base': 'xyz', 'shipwright/tools': 'abc'}
+    assert dockerfile.tag_parent(df, tags) == (
+        'FROM ubuntu AS build\n'
+        'FROM shipwright/base:xyz AS runtime\n'
+        'COPY --from=shipwright/tools:abc /bin/tool /bin/\n'
+        'FROM build\n'
+        'FROM --platform=linux/amd64 shipwright/base:xyz\n'
+    )
+
+
+def test_tag_parent_copy_from():
+    df = dockerfile.parse(
+        'FROM ubuntu AS build\n'
+        'COPY --chown=app --from=shipwright/tools a /b/\n'
+        'COPY --from=build /out /app/\n'
+        'COPY --from=tools:1 /bin/tool /bin/\n'
+        'COPY --from=0 /out /app/\n',
+    )
+    assert df.parents == ('ubuntu', 'shipwright/tools', 'tools:1')
+
+    tags = {'shipwright/tools': 'abc', 'ubuntu': 'xyz'}
+    assert dockerfile.tag_parent(df, tags) == (
+        'FROM ubuntu:xyz AS build\n'
+        'COPY --chown=app --from=shipwright/tools:abc a /b/\n'
+        'COPY --from=build /out /app/\n'
+        'COPY --from=tools:1 /bin/tool /bin/\n'
+        'COPY --from=0 /out /app/\n'
+    )
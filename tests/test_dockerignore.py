@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+
+import os
+import random
+
+from docker import utils
+
+from shipwright._lib import dockerignore
+
+NAMES = [
+    'a', 'b', 'A', 'foo', 'x.py', 'y.txt', 'Dockerfile', '.dockerignore',
+    'sub', 'node_modules',
+]
+
+PATTERNS = [
+    'a', 'b/', '/foo', '*.py', '**/*.py', 'foo/**', '**', 'sub/*', '?',
+    '[ab]', '[!a]*', 'A', 'node_modules', '*/x.py', 'foo/../a', './b',
+    'sub/**/y.txt', '*', '**/foo', 'Dockerfile', '.dockerignore', 'x.p[y]',
+    'a/b', 'foo[', '!a', '!foo/x.py', '!**/*.py', '!sub', '!sub/y.txt', '!/b',
+    '!*.txt', '![',
+]
+
+
+def make_tree(rand, root, depth):
+    for name in rand.sample(NAMES, rand.randint(1, 5)):
+        path = root.join(name)
+        if depth and rand.random() < 0.5:
+            path.mkdir()
+            make_tree(rand, path, depth - 1)
+        else:
+            path.write('')
+
+
+def test_same_paths_as_docker_py(tmpdir):
+    rand = random.Random(0)
+    for i in range(200):
+        root = tmpdir.mkdir(str(i))
+        make_tree(rand, root, 3)
+        patterns = rand.sample(PATTERNS, rand.randint(0, 6))
+        dockerfile = rand.choice(['Dockerfile', 'sub/Dockerfile', 'x.py'])
+
+        paths = dockerignore.exclude_paths(str(root), patterns, dockerfile)
+        assert paths == set(
+            utils.exclude_paths(str(root), patterns, dockerfile),
+        ), patterns
+
+
+def test_ignored_directories_are_not_walked(tmpdir, monkeypatch):
+    tmpdir.mkdir('keep').join('a.py').write('')
+    tmpdir.mkdir('ignored').mkdir('deep').join('b.py').write('')
+    tmpdir.mkdir('logs').join('keep.log').write('')
+    tmpdir.join('logs/other.log').write('')
+    tmpdir.join('Dockerfile').write('')
+
+    walked = []
+    walk = os.walk
+
+    def spy(*args, **kwargs):
+        for parent, dirs, files in walk(*args, **kwargs):
+            walked.append(os.path.relpath(parent, str(tmpdir)))
+            yield parent, dirs, files
+
+    monkeypatch.setattr(os, 'walk', spy)
+    paths = dockerignore.exclude_paths(
+        str(tmpdir), ['ignored', 'logs', '!logs/keep.log'],
+    )
+
+    assert sorted(paths) == [
+        'Dockerfile', 'keep', 'keep/a.py', 'logs/keep.log',
+    ]
+    assert sorted(walked) == ['.', 'keep', 'logs']
@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+import os
+
+from shipwright._lib import dockerfile, image_index
+
+
+def _old_dockerfile(tmpdir, content):
+    f = tmpdir.join('Dockerfile')
+    f.write(content)
+    os.utime(str(f), (1000000000, 1000000000))
+    return str(f)
+
+
+def test_hit_by_blob(tmpdir, monkeypatch):
+    docker_path = _old_dockerfile(tmpdir, 'FROM base\nCOPY a /code/\n')
+    path = str(tmpdir.join('cache', 'images.json'))
+
+    index = image_index.ImageIndex(path)
+    assert index.load(docker_path, 'abc').parents == ('base',)
+    index.save()
+
+    def fail(path):
+        raise AssertionError(path)
+
+    monkeypatch.setattr(dockerfile, 'load', fail)
+    parsed = image_index.ImageIndex(path).load(docker_path, 'abc')
+    assert parsed.parent == 'base'
+    assert parsed.copy_sources == ('a',)
+
+
+def test_other_blob_is_a_miss(tmpdir):
+    docker_path = _old_dockerfile(tmpdir, 'FROM base\n')
+    path = str(tmpdir.join('images.json'))
+
+    index = image_index.ImageIndex(path)
+    index.load(docker_path, 'abc')
+    index.save()
+
+    _old_dockerfile(tmpdir, 'FROM other\n')
+    index = image_index.ImageIndex(path)
+    assert index.load(docker_path, 'def').parent == 'other'
+
+
+def test_changed_stat_is_a_miss(tmpdir):
+    docker_path = _old_dockerfile(tmpdir, 'FROM base\n')
+    path = str(tmpdir.join('images.json'))
+
+    index = image_index.ImageIndex(path)
+    index.load(docker_path)
+    index.save()
+
+    _old_dockerfile(tmpdir, 'FROM other\n')
+    assert image_index.ImageIndex(path).load(docker_path).parent == 'other'
+
+
+def test_racy_stat_entries_are_dropped(tmpdir):
+    f = tmpdir.join('Dockerfile')
+    f.write('FROM base\n')
+    future = 4000000000
+    os.utime(str(f), (future, future))
+    path = str(tmpdir.join('images.json'))
+
+    index = image_index.ImageIndex(path)
+    index.load(str(f))
+    index.save()
+
+    index = image_index.ImageIndex(path)
+    index.load(str(f))
+    assert index._changed
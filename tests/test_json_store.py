@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+
+import json
+import os
+
+from shipwright._lib import json_store
+
+
+def _entry_mtime(entry):
+    return entry.get('mtime')
+
+
+def test_dump(tmpdir):
+    path = str(tmpdir.join('cache', 'data.json'))
+    assert json_store.dump(path, {'a': 1})
+    assert json.load(open(path)) == {'a': 1}
+    # no temporary file is left behind
+    assert os.listdir(os.path.dirname(path)) == ['data.json']
+
+
+def test_dump_failure(tmpdir):
+    tmpdir.join('cache').write('not a directory')
+    path = str(tmpdir.join('cache', 'data.json'))
+    assert not json_store.dump(path, {'a': 1})
+
+
+def test_entries_round_trip_without_racy_ones(tmpdir):
+    path = str(tmpdir.join('entries.json'))
+    future = 4000000000 * 10 ** 9
+    entries = {
+        'old': {'mtime': 1},
+        'racy': {'mtime': future},
+        'unkeyed': {'mtime': None},
+    }
+
+    written = json_store.dump_entries(path, entries, _entry_mtime)
+    assert written == {'old': {'mtime': 1}, 'unkeyed': {'mtime': None}}
+    assert json_store.load_entries(path, _entry_mtime) == written
+
+
+def test_racy_entries_are_not_loaded(tmpdir):
+    path = tmpdir.join('entries.json')
+    path.write(json.dumps({'entries': {'a': {'mtime': 5}, 'b': {}}}))
+    os.utime(str(path), (0, 0))
+
+    assert json_store.load_entries(str(path), _entry_mtime) == {'b': {}}
+
+
+def test_unreadable_entries_are_empty(tmpdir):
+    path = tmpdir.join('entries.json')
+    assert json_store.load_entries(str(path), _entry_mtime) == {}
+    path.write('{not json')
+    assert json_store.load_entries(str(path), _entry_mtime) == {}
@@ -0,0 +1,45 @@
+from __future__ import absolute_import
+
+import os
+
+from shipwright._lib import ref_cache
+
+
+def test_round_trip(tmpdir):
+    cache = ref_cache.RefCache(str(tmpdir.join('refs')))
+    assert cache.get('a' * 40) == {}
+
+    refs = {('base',): 'b' * 40, ('base', 'shared/*.txt'): None}
+    cache.put('a' * 40, refs)
+    assert cache.get('a' * 40) == refs
+
+
+def test_prune_keeps_most_recent_heads(tmpdir):
+    cache_dir = tmpdir.join('refs')
+    cache = ref_cache.RefCache(str(cache_dir), max_heads=2)
+    for i, head in enumerate(['1', '2', '3']):
+        cache.put(head, {('base',): head})
+        os.utime(str(cache_dir.join(head + '.json')), (i, i))
+    cache.prune()
+
+    assert sorted(cache_dir.listdir()) == [
+        cache_dir.join('2.json'), cache_dir.join('3.json'),
+    ]
+    assert cache.get('1') == {}
+
+
+def test_unreadable_cache_is_a_miss(tmpdir):
+    cache_dir = tmpdir.mkdir('refs')
+    cache_dir.join('a.json').write('{not json')
+    cache = ref_cache.RefCache(str(cache_dir))
+    assert cache.get('a') == {}
+
+
+def test_keyed_by_shallow_state(tmpdir):
+    cache = ref_cache.RefCache(str(tmpdir.join('refs')))
+    refs = {('base',): 'b' * 40}
+    cache.put('a' * 40, refs, shallow='c' * 40)
+
+    assert cache.get('a' * 40, shallow='c' * 40) == refs
+    assert cache.get('a' * 40, shallow='d' * 40) == {}
+    assert cache.get('a' * 40) == {}
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+from conftest import target
+from shipwright._lib import schedule
+
+targets = [
+    target('base'),
+    target('quick', 'base'),
+    target('slow', 'base'),
+    target('slow-app', 'slow'),
+    target('other'),
+]
+
+
+def test_estimates_default_to_the_mean():
+    durations = {'base': 2.0, 'slow': 4.0}
+    assert schedule.estimates(targets, durations) == {
+        'base': 2.0, 'quick': 3.0, 'slow': 4.0, 'slow-app': 3.0, 'other': 3.0,
+    }
+    assert schedule.estimates(targets, {}) == {
+        t.name: schedule.DEFAULT_ESTIMATE for t in targets
+    }
+
+
+def test_critical_path_starts_first():
+    durations = {
+        'base': 1.0, 'quick': 1.0, 'slow': 5.0, 'slow-app': 5.0, 'other': 2.0,
+    }
+    est = schedule.estimates(targets, durations)
+    priority = schedule.priorities(targets, est)
+    assert priority['base'] == 11.0
+
+    makespan, started = schedule.simulate(targets, est, priority, 2)
+    assert [t.name for t, _ in started] == [
+        'base', 'other', 'slow', 'quick', 'slow-app',
+    ]
+    assert makespan == 11.0
+
+    zero = {t.name: 0 for t in targets}
+    makespan, started = schedule.simulate(targets, est, zero, 1)
+    assert [t.name for t, _ in started] == [t.name for t in targets]
+    assert makespan == 14.0
+
+
+def test_explain():
+    lines = schedule.explain(targets[:2], {'base': 2.0}, 1)
+    assert lines == [
+        'Predicted makespan: 4.0s with 1 job(s)',
+        '   1. base starts at 0.0s, takes 2.0s, longest chain 4.0s',
+        '   2. quick starts at 2.0s, takes 2.0s (estimated), '
+        'longest chain 2.0s',
+    ]
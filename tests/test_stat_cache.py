@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+
+import os
+
+from shipwright._lib import stat_cache
+
+
+def _old_file(tmpdir, name, content):
+    f = tmpdir.join(name)
+    f.write(content)
+    os.utime(str(f), (1000000000, 1000000000))
+    return os.stat(str(f))
+
+
+def test_hit_after_save(tmpdir):
+    st = _old_file(tmpdir, 'a.txt', 'hi')
+    path = str(tmpdir.join('cache', 'stat-cache.json'))
+
+    cache = stat_cache.StatCache(path)
+    assert cache.get('a.txt', st) is None
+    cache.set('a.txt', st, 'abc')
+    cache.save()
+
+    assert stat_cache.StatCache(path).get('a.txt', st) == 'abc'
+
+
+def test_changed_stat_is_a_miss(tmpdir):
+    st = _old_file(tmpdir, 'a.txt', 'hi')
+    path = str(tmpdir.join('stat-cache.json'))
+
+    cache = stat_cache.StatCache(path)
+    cache.set('a.txt', st, 'abc')
+    cache.save()
+
+    st = _old_file(tmpdir, 'a.txt', 'hi mum')
+    assert stat_cache.StatCache(path).get('a.txt', st) is None
+
+
+def test_racily_clean_entries_are_dropped(tmpdir):
+    f = tmpdir.join('a.txt')
+    f.write('hi')
+    future = 4000000000
+    os.utime(str(f), (future, future))
+    st = os.stat(str(f))
+    path = str(tmpdir.join('stat-cache.json'))
+
+    cache = stat_cache.StatCache(path)
+    cache.set('a.txt', st, 'abc')
+    cache.save()
+
+    assert stat_cache.StatCache(path).get('a.txt', st) is None
+
+
+def test_unseen_entries_are_not_kept(tmpdir):
+    st_a = _old_file(tmpdir, 'a.txt', 'a')
+    st_b = _old_file(tmpdir, 'b.txt', 'b')
+    path = str(tmpdir.join('stat-cache.json'))
+
+    cache = stat_cache.StatCache(path)
+    cache.set('a.txt', st_a, 'aaa')
+    cache.set('b.txt', st_b, 'bbb')
+    cache.save()
+
+    cache = stat_cache.StatCache(path)
+    assert cache.get('a.txt', st_a) == 'aaa'
+    cache.save()
+
+    cache = stat_cache.StatCache(path)
+    assert cache.get('a.txt', st_a) == 'aaa'
+    assert cache.get('b.txt', st_b) is None
+
+
+def test_unchanged_cache_is_not_written(tmpdir):
+    st = _old_file(tmpdir, 'a.txt', 'a')
+    path = tmpdir.join('stat-cache.json')
+
+    # a clean tree, nothing looked up
+    stat_cache.StatCache(str(path)).save()
+    assert not path.check()
+
+    cache = stat_cache.StatCache(str(path))
+    cache.set('a.txt', st, 'aaa')
+    cache.save()
+    os.utime(str(path), (1500000000, 1500000000))
+
+    cache = stat_cache.StatCache(str(path))
+    assert cache.get('a.txt', st) == 'aaa'
+    cache.save()
+    assert path.mtime() == 1500000000
@@ -63,3 +63,10 @@ def test_error():
             'message': 'I AM ERROR',
         },
     }) == '[ERROR] I AM ERROR'
+
+
+def test_skipped():
+    assert switch({
+        'event': 'skipped',
+        'failed': 'shipwright/base',
+    }) == '[SKIPPED] shipwright/base failed to build'
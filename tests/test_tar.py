@@ -1,8 +1,25 @@
 from __future__ import absolute_import
 
+import io
+import os
 import tarfile
 
-from shipwright._lib import tar
+from shipwright._lib import context_cache, image, tar
+
+
+def read_context(tags, docker_path, **kwargs):
+    chunks = list(tar.mkcontext(tags, docker_path, **kwargs))
+    data = b''.join(chunks)
+    assert len(data) % tarfile.RECORDSIZE == 0
+    return chunks, tarfile.open(fileobj=io.BytesIO(data))
+
+
+def hash_files(root, blob_ids):
+    """Adds the blob ids git would have for the files below root."""
+    for parent, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(parent, name)
+            blob_ids[path] = tar._blob_id(path, os.path.getsize(path))
 
 
 def test_mkcontext(tmpdir):
@@ -11,11 +28,13 @@ def test_mkcontext(tmpdir):
     docker_path.write('FROM example.com/r/image')
     tmp.join('bogus').write('hi mom')
 
-    with tar.mkcontext('xyz', str(docker_path)) as f:
-        with tarfile.open(fileobj=f, mode='a') as t:
-            names = t.getnames()
+    tags = {'example.com/r/image': 'xyz'}
+    _, t = read_context(tags, str(docker_path))
 
-    assert names == ['', 'bogus', 'Dockerfile']
+    assert t.getnames() == ['bogus', 'Dockerfile']
+    dockerfile = t.extractfile('Dockerfile').read()
+    assert dockerfile == b'FROM example.com/r/image:xyz'
+    assert t.extractfile('bogus').read() == b'hi mom'
 
 
 def test_mkcontext_dockerignore(tmpdir):
@@ -26,8 +45,149 @@ def test_mkcontext_dockerignore(tmpdir):
     tmp.join('bogus').write('hi mom')
     tmp.join('bogus2').write('This is ignored')
 
-    with tar.mkcontext('xyz', str(docker_path)) as f:
-        with tarfile.open(fileobj=f, mode='a') as t:
-            names = t.getnames()
+    tags = {'example.com/r/image': 'xyz'}
+    _, t = read_context(tags, str(docker_path))
+
+    assert t.getnames() == ['.dockerignore', 'bogus', 'Dockerfile']
+
+
+def test_mkcontext_streams_in_chunks(tmpdir):
+    tmp = tmpdir.mkdir('image')
+    docker_path = tmp.join('Dockerfile')
+    docker_path.write('FROM ubuntu')
+    content = os.urandom(5 * tar.CHUNK_SIZE + 1)
+    tmp.mkdir('data').join('big').write(content, mode='wb')
+
+    chunks, t = read_context({}, str(docker_path))
+
+    assert len(chunks) > 5
+    assert max(len(c) for c in chunks) < 2 * tar.CHUNK_SIZE
+    assert t.getnames() == ['Dockerfile', 'data', 'data/big']
+    assert t.extractfile('data/big').read() == content
+    assert t.extractfile('Dockerfile').read() == b'FROM ubuntu'
+
+
+def test_mkcontext_cached(tmpdir):
+    tmp = tmpdir.mkdir('image')
+    docker_path = tmp.join('Dockerfile')
+    docker_path.write('FROM example.com/r/image')
+    tmp.join('bogus').write('hi mom')
+    blob_ids = {}
+    hash_files(str(tmp), blob_ids)
+    contexts = context_cache.ContextCache(
+        str(tmpdir.join('contexts')), blob_ids=lambda: blob_ids,
+    )
+    tags = {'example.com/r/image': 'xyz'}
+
+    first = b''.join(tar.mkcontext(tags, str(docker_path), contexts))
+    os.utime(str(tmp.join('bogus')), (1, 1))
+    with tar.mkcontext(tags, str(docker_path), contexts) as f:
+        assert f.read() == first
+    t = tarfile.open(fileobj=io.BytesIO(first))
+    assert t.getnames() == ['bogus', 'Dockerfile']
+    assert {m.mtime for m in t.getmembers()} == {0}
+
+    tmp.join('bogus').write('hi dad')
+    hash_files(str(tmp), blob_ids)
+    second = b''.join(tar.mkcontext(tags, str(docker_path), contexts))
+    assert second != first
+    t = tarfile.open(fileobj=io.BytesIO(second))
+    assert t.extractfile('bogus').read() == b'hi dad'
+
+    tags = {'example.com/r/image': 'abc'}
+    third = b''.join(tar.mkcontext(tags, str(docker_path), contexts))
+    assert third not in (first, second)
+    assert len(tmpdir.join('contexts').listdir()) == 3
+
+
+def test_mkcontext_uses_blob_ids(tmpdir):
+    tmp = tmpdir.mkdir('image')
+    docker_path = tmp.join('Dockerfile')
+    docker_path.write('FROM ubuntu')
+    tmp.join('bogus').write('hi mom')
+    blob_ids = {}
+    contexts = context_cache.ContextCache(
+        str(tmpdir.join('contexts')), blob_ids=lambda: blob_ids,
+    )
+
+    # files git has not hashed would have to be read to digest the context
+    b''.join(tar.mkcontext({}, str(docker_path), contexts))
+    assert not tmpdir.join('contexts').check()
+
+    hash_files(str(tmp), blob_ids)
+    first = b''.join(tar.mkcontext({}, str(docker_path), contexts))
+    # git knows better than the worktree, so the cached context is used
+    tmp.join('bogus').write('hi dad')
+    with tar.mkcontext({}, str(docker_path), contexts) as f:
+        assert f.read() == first
+
+
+def test_mkcontext_too_large_to_cache(tmpdir):
+    tmp = tmpdir.mkdir('image')
+    docker_path = tmp.join('Dockerfile')
+    docker_path.write('FROM ubuntu')
+    tmp.join('bogus').write('hi mom')
+    blob_ids = {}
+    hash_files(str(tmp), blob_ids)
+    contexts = context_cache.ContextCache(
+        str(tmpdir.join('contexts')), max_bytes=10, blob_ids=lambda: blob_ids,
+    )
+
+    _, t = read_context({}, str(docker_path), contexts=contexts)
+    assert t.getnames() == ['Dockerfile', 'bogus']
+    assert not tmpdir.join('contexts').check()
+    # the same metadata as the contexts that are kept
+    assert {m.mtime for m in t.getmembers()} == {0}
+
+
+def test_mkcontext_minimal(tmpdir):
+    tmp = tmpdir.mkdir('image')
+    docker_path = tmp.join('Dockerfile')
+    docker_path.write(
+        'FROM example.com/r/image\n'
+        'COPY src/*.py app.cfg /app/\n'
+        'ADD lib /lib/\n',
+    )
+    tmp.join('.dockerignore').write('src/ignored.py')
+    tmp.join('app.cfg').write('cfg')
+    tmp.join('fixtures').mkdir().join('data').write('x' * 1000)
+    src = tmp.mkdir('src')
+    src.join('main.py').write('main')
+    src.join('ignored.py').write('ignored')
+    src.join('notes.txt').write('notes')
+    tmp.mkdir('lib').mkdir('sub').join('x.so').write('x')
+
+    sources = image.copy_paths(str(docker_path))
+    files = tar.context_files({}, str(docker_path), sources)
+
+    assert files.paths == [
+        '.dockerignore', 'Dockerfile', 'app.cfg', 'lib', 'lib/sub',
+        'lib/sub/x.so', 'src', 'src/main.py',
+    ]
+    assert files.left_out == 1000 + len('notes')
+
+    tags = {'example.com/r/image': 'xyz'}
+    _, t = read_context(tags, str(docker_path), sources=sources)
+    assert t.getnames() == [
+        '.dockerignore', 'app.cfg', 'lib', 'lib/sub', 'lib/sub/x.so', 'src',
+        'src/main.py', 'Dockerfile',
+    ]
+
+
+def test_mkcontext_minimal_glob_matches_directory(tmpdir):
+    tmp = tmpdir.mkdir('image')
+    docker_path = tmp.join('Dockerfile')
+    docker_path.write('FROM ubuntu\nCOPY src/*.js /app/\n')
+    src = tmp.mkdir('src')
+    src.join('a.js').write('a')
+    src.join('a.css').write('css')
+    # COPY copies a directory matched by the glob whole
+    src.mkdir('lib.js').join('index').write('index')
+
+    sources = image.copy_paths(str(docker_path))
+    files = tar.context_files({}, str(docker_path), sources)
 
-    assert names == ['', '.dockerignore', 'bogus', 'Dockerfile']
+    assert files.paths == [
+        'Dockerfile', 'src', 'src/a.js', 'src/lib.js', 'src/lib.js/index',
+    ]
+    assert files.left_out == len('css')